@@ -0,0 +1 @@
+"""synthetic fixtures and throughput benchmarks for every pack and unpack entry point, run with python -m benchmarks"""
@@ -0,0 +1,282 @@
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional, Tuple
+from dataclasses import dataclass, asdict
+from pathlib import Path
+import tracemalloc
+import argparse
+import tempfile
+import shutil
+import hashlib
+import json
+import time
+import zlib
+import sys
+
+from ipodhax.img1 import pack_img1, unpack_img1
+from ipodhax.mse import pack_mse, unpack_mse
+from ipodhax.silverdb import pack_silverdb, unpack_silverdb
+
+from .fixtures import SILVERDB_FORMATS, MSE_TYPES, make_silverdb_directory, make_img1_directory, make_mse_directory
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+MEMORY_SLACK = 0x100000  # small peaks jitter by more than any sensible tolerance
+MIN_SECONDS = 0.5  # every repeat calls the entry point until this much time went by, a single few ms call is mostly noise
+REFERENCE_DATA = bytes(range(256)) * 0x4000  # 4 MiB for the reference workload
+
+
+@dataclass
+class Result:
+    name: str
+    seconds: float  # per call, in the median repeat
+    calls: int  # how many calls that repeat averaged over
+    reference_seconds: float  # per call of the reference workload, interleaved with those calls
+    bytes: int  # size of the packed side, whichever way the data goes
+    images: int
+    peak_memory: int  # python allocations only, memory maps don't show up
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.bytes / self.seconds / 1e6
+
+    @property
+    def images_per_s(self) -> float:
+        return self.images / self.seconds
+
+    @property
+    def relative_speed(self) -> float:
+        # what the baseline comparison uses, how fast the host is at the time cancels out
+        return self.reference_seconds / self.seconds
+
+
+@dataclass
+class Benchmark:
+    name: str
+    run: Callable[[Path], None]  # gets a fresh empty directory to write into
+    bytes: int
+    images: int
+
+
+def _file_step(function: Callable, source, name: str, **kwargs) -> Callable[[Path], None]:
+    # pack functions: a directory in, one file out
+    def run(output: Path):
+        with open(output / name, "wb") as stream:
+            function(stream, source, **kwargs)
+    return run
+
+
+def _directory_step(function: Callable, source: Path) -> Callable[[Path], None]:
+    # unpack functions: one file in, a directory out
+    def run(output: Path):
+        with open(source, "rb") as stream:
+            function(stream, output)
+    return run
+
+
+def make_benchmarks(work: Path, config: dict) -> List[Benchmark]:
+    silverdb_source = work / "silverdb"
+    make_silverdb_directory(
+        silverdb_source,
+        count=config["images"],
+        width=config["width"],
+        height=config["height"],
+        formats=config["formats"],
+        seed=config["seed"]
+    )
+    img1_source = work / "img1"
+    make_img1_directory(img1_source, body_size=config["body_size"], seed=config["seed"])
+    mse_source = work / "mse"
+    mse_count = make_mse_directory(
+        mse_source,
+        work / "mse_img1",
+        image_types=config["mse_types"],
+        body_size=config["body_size"],
+        seed=config["seed"]
+    )
+
+    # the packed files double as the unpack inputs
+    packed = work / "packed"
+    packed.mkdir()
+    _file_step(pack_silverdb, silverdb_source, "silverdb.db", write_manifest=False)(packed)
+    _file_step(pack_img1, img1_source, "image.img1")(packed)
+    _file_step(pack_mse, mse_source, "Firmware.MSE", device=6)(packed)
+
+    silverdb_length = (packed / "silverdb.db").stat().st_size
+    img1_length = (packed / "image.img1").stat().st_size
+    mse_length = (packed / "Firmware.MSE").stat().st_size
+
+    return [
+        Benchmark("pack_silverdb", _file_step(pack_silverdb, silverdb_source, "silverdb.db", write_manifest=False), silverdb_length, config["images"]),
+        Benchmark("unpack_silverdb", _directory_step(unpack_silverdb, packed / "silverdb.db"), silverdb_length, config["images"]),
+        Benchmark("pack_img1", _file_step(pack_img1, img1_source, "image.img1"), img1_length, 1),
+        Benchmark("unpack_img1", _directory_step(unpack_img1, packed / "image.img1"), img1_length, 1),
+        Benchmark("pack_mse", _file_step(pack_mse, mse_source, "Firmware.MSE", device=6), mse_length, mse_count),
+        Benchmark("unpack_mse", _directory_step(unpack_mse, packed / "Firmware.MSE"), mse_length, mse_count)
+    ]
+
+
+def _call(benchmark: Benchmark, work: Path) -> float:
+    output = Path(tempfile.mkdtemp(dir=work))
+    try:
+        start = time.perf_counter()
+        benchmark.run(output)
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(output)
+
+
+def _reference_call(work: Path) -> float:
+    # a fixed mix of hashing, compression and writing a file, roughly what the entry points spend their time on
+    start = time.perf_counter()
+    hashlib.sha256(REFERENCE_DATA).digest()
+    zlib.compress(REFERENCE_DATA[:0x40000], 6)
+    path = work / "reference.bin"
+    path.write_bytes(REFERENCE_DATA)
+    path.unlink()
+    return time.perf_counter() - start
+
+
+def _timed_repeat(benchmark: Benchmark, work: Path, min_seconds: float) -> Tuple[float, float, int]:
+    # like timeit's autorange but on a time budget, with a reference call before every call so both see the host
+    # the same way. returns seconds per call, reference seconds per call and the number of calls
+    total = 0.0
+    reference_total = 0.0
+    calls = 0
+    while total < min_seconds or calls == 0:
+        reference_total += _reference_call(work)
+        total += _call(benchmark, work)
+        calls += 1
+    return total / calls, reference_total / calls, calls
+
+
+def measure(benchmark: Benchmark, work: Path, *, repeat: int, min_seconds: float = MIN_SECONDS) -> Result:
+    # the host's speed drifts between runs and even within one, absolute numbers from another run are noise.
+    # what gets compared is the speed relative to the reference, taken from the median repeat
+    repeats = sorted((_timed_repeat(benchmark, work, min_seconds) for _ in range(repeat)), key=lambda values: values[1] / values[0])
+    seconds, reference_seconds, calls = repeats[len(repeats) // 2]
+
+    # tracemalloc slows everything down, so memory gets its own run
+    tracemalloc.start()
+    try:
+        _call(benchmark, work)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Result(benchmark.name, seconds, calls, reference_seconds, benchmark.bytes, benchmark.images, peak_memory)
+
+
+def compare(results: List[Result], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """names the measurements that got worse than the baseline by more than tolerance"""
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.name)
+        if expected is None:
+            continue
+
+        if result.relative_speed < expected["relative_speed"] * (1 - tolerance):
+            regressions.append(
+                f"{result.name}: {result.relative_speed / expected['relative_speed'] - 1:+.0%} relative to the reference "
+                f"({result.mb_per_s:.1f} MB/s, baseline {expected['mb_per_s']:.1f} MB/s)"
+            )
+        if result.peak_memory > expected["peak_memory"] * (1 + tolerance) + MEMORY_SLACK:
+            regressions.append(
+                f"{result.name}: {result.peak_memory / 1e6:.1f} MB peak, baseline {expected['peak_memory'] / 1e6:.1f} MB"
+            )
+
+    return regressions
+
+
+def _result_json(result: Result) -> dict:
+    data = asdict(result)
+    data["mb_per_s"] = result.mb_per_s
+    data["images_per_s"] = result.images_per_s
+    data["relative_speed"] = result.relative_speed
+    return data
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--images", type=int, default=240, help="images in the SilverDB")
+    parser.add_argument("--width", type=int, default=96)
+    parser.add_argument("--height", type=int, default=96)
+    parser.add_argument(
+        "--formats", type=lambda value: [int(image_format, 16) for image_format in value.split(",")],
+        default=list(SILVERDB_FORMATS), help="comma separated hex formats, used in turn"
+    )
+    parser.add_argument("--body-size", type=lambda value: int(value, 0), default=0x800000, help="body length of every IMG1")
+    parser.add_argument(
+        "--mse-types", type=lambda value: value.split(","), default=list(MSE_TYPES), help="comma separated slot names"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--min-seconds", type=float, default=MIN_SECONDS, help="time every repeat spends calling one entry point"
+    )
+    parser.add_argument("--only", action="append", help="run just this entry point, can be given more than once")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown or memory growth, 0.2 is 20%%")
+    parser.add_argument("--json", type=Path, help="also write the results here")
+    args = parser.parse_args(argv)
+
+    config = {
+        "images": args.images,
+        "width": args.width,
+        "height": args.height,
+        "formats": args.formats,
+        "body_size": args.body_size,
+        "mse_types": args.mse_types,
+        "seed": args.seed
+    }
+
+    baseline = {}
+    if args.baseline.exists() and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_stream:
+            baseline_data = json.load(baseline_stream)
+
+        if baseline_data["config"] != config:
+            print("baseline was recorded with other fixtures, not comparing", file=sys.stderr)
+        elif any("relative_speed" not in result for result in baseline_data["results"].values()):
+            print("baseline was recorded without reference timings, not comparing", file=sys.stderr)
+        else:
+            baseline = baseline_data["results"]
+
+    with tempfile.TemporaryDirectory() as work:
+        work = Path(work)
+        benchmarks = make_benchmarks(work, config)
+
+        results = []
+        for benchmark in benchmarks:
+            if args.only and benchmark.name not in args.only:
+                continue
+
+            result = measure(benchmark, work, repeat=args.repeat, min_seconds=args.min_seconds)
+            results.append(result)
+
+            expected = baseline.get(result.name)
+            change = "" if expected is None else f" ({result.relative_speed / expected['relative_speed'] - 1:+.0%})"
+            print(
+                f"{result.name:<16} {result.seconds * 1000:9.1f} ms {result.mb_per_s:9.1f} MB/s{change:<8} "
+                f"{result.images_per_s:9.1f} images/s {result.peak_memory / 1e6:8.1f} MB peak"
+            )
+
+    data = {"config": config, "results": {result.name: _result_json(result) for result in results}}
+    if args.json is not None:
+        with open(args.json, "w", encoding="utf-8") as json_stream:
+            json.dump(data, fp=json_stream, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as baseline_stream:
+            json.dump(data, fp=baseline_stream, indent=2)
+        print(f"saved baseline to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"regression: {regression}", file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
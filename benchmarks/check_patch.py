@@ -0,0 +1,113 @@
+"""
+checks patch_mse against a fresh pack_mse of the same directory, run with python -m benchmarks.check_patch
+
+a patch that grows a slot, keeps its size or shrinks it within its padding has to give the same bytes as packing
+again. one that shrinks a slot by more than that keeps the freed space in place, so only the slots are compared.
+"""
+from __future__ import annotations
+from typing import List, Optional
+from pathlib import Path
+import argparse
+import tempfile
+import shutil
+import sys
+
+from ipodhax.mse import MseArchive, pack_mse, patch_mse
+from ipodhax.mse.reader import ImageMetadata
+
+from .fixtures import MSE_TYPES, make_img1, make_mse_directory
+
+# (name, new body size from the fixture's, whether the patched file has to equal a fresh pack)
+CASES = (
+    ("grow", lambda size: size * 2, True),
+    ("same size", lambda size: size, True),
+    ("shrink within padding", lambda size: size - 0x100, True),
+    ("shrink", lambda size: size // 4, False),
+)
+
+
+def _layout_free(image: ImageMetadata) -> tuple:
+    # everything in a table entry except where the slot sits
+    return image.target, image.type, image.length, image.address, image.entry_offset, image.version, image.load_address
+
+
+def compare_slots(patched: Path, packed: Path) -> Optional[str]:
+    """None if both MSEs hold the same slots with the same contents, otherwise what differs"""
+    with MseArchive.open(patched) as patched_archive, MseArchive.open(packed) as packed_archive:
+        if list(patched_archive) != list(packed_archive):
+            return f"slots {list(patched_archive)} != {list(packed_archive)}"
+
+        for image_type in packed_archive:
+            if _layout_free(patched_archive.metadata(image_type)) != _layout_free(packed_archive.metadata(image_type)):
+                return f"{image_type} table entry differs"
+
+            patched_view = patched_archive.view(image_type)
+            packed_view = packed_archive.view(image_type)
+            equal = patched_view == packed_view
+            patched_view.release()
+            packed_view.release()
+            if not equal:
+                return f"{image_type} contents differ"
+
+    return None
+
+
+def check(work: Path, *, image_types: List[str], body_size: int, device: int = 6) -> List[str]:
+    """patches every case into every one of image_types, returns a line per failure"""
+    directory = work / "mse"
+    make_mse_directory(directory, work / "img1", body_size=body_size)
+    base = work / "base.mse"
+    with open(base, "wb") as stream:
+        pack_mse(stream, directory, device=device)
+
+    failures = []
+    for image_type in image_types:
+        for name, new_size, identical in CASES:
+            case_directory = work / "case"
+            shutil.rmtree(case_directory, ignore_errors=True)
+            shutil.copytree(directory, case_directory)
+
+            replacement = case_directory / f"{image_type}.img1"
+            make_img1(replacement, work / "replacement", body_size=new_size(body_size), seed=1000)
+
+            patched = work / "patched.mse"
+            shutil.copyfile(base, patched)
+            with open(patched, "r+b") as stream:
+                patch_mse(stream, image_type, replacement)
+
+            packed = work / "packed.mse"
+            with open(packed, "wb") as stream:
+                pack_mse(stream, case_directory, device=device)
+
+            if identical:
+                if patched.read_bytes() != packed.read_bytes():
+                    failures.append(f"{image_type} {name}: patched output differs from a fresh pack")
+                    continue
+
+            difference = compare_slots(patched, packed)
+            if difference is not None:
+                failures.append(f"{image_type} {name}: {difference}")
+
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.check_patch", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--body-size", type=lambda value: int(value, 0), default=0x100000)
+    parser.add_argument(
+        "--types", type=lambda value: value.split(","), default=[MSE_TYPES[0], MSE_TYPES[len(MSE_TYPES) // 2], MSE_TYPES[-1]],
+        help="slots to patch, comma separated. defaults to the first, a middle and the last one"
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work:
+        failures = check(Path(work), image_types=args.types, body_size=args.body_size)
+
+    for failure in failures:
+        print(failure)
+    print(f"{len(args.types) * len(CASES) - len(failures)} of {len(args.types) * len(CASES)} patches ok")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+from typing import Iterable, Literal, Sequence
+from pathlib import Path
+import json
+
+from PIL import Image
+import numpy as np
+
+from ipodhax.img1 import pack_img1
+from ipodhax.mse import pack_mse
+from ipodhax.silverdb import pack_silverdb
+
+# everything here is made from a seeded generator, the same arguments always give the same bytes
+
+SILVERDB_FORMATS = (0x1888, 0x0004, 0x0008, 0x0565, 0x0064, 0x0065)
+MSE_TYPES = ("disk", "diag", "appl", "lbat", "bdsw", "bdhw", "chrg", "rsrc", "osos")
+
+CERT_LENGTH = 769
+
+
+def _pixels(rng: np.random.Generator, image_format: int, width: int, height: int) -> Image.Image:
+    if image_format == 0x0004:
+        return Image.fromarray(rng.integers(0, 16, (height, width), dtype=np.uint8) * 17, "L")
+    elif image_format == 0x0008:
+        return Image.fromarray(rng.integers(0, 256, (height, width), dtype=np.uint8), "L")
+    elif image_format == 0x0565:
+        return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), "RGB")
+    elif image_format in {0x0064, 0x0065}:
+        # icons and wallpapers only use a handful of colors
+        palette = rng.integers(0, 256, (200 if image_format == 0x0064 else 2000, 4), dtype=np.uint8)
+        return Image.fromarray(palette[rng.integers(0, len(palette), (height, width))], "RGBA")
+    elif image_format == 0x1888:
+        return Image.fromarray(rng.integers(0, 256, (height, width, 4), dtype=np.uint8), "RGBA")
+    else:
+        raise ValueError(f"cannot generate unknown format {image_format:04x}")
+
+
+def make_silverdb_directory(
+    directory: Path,
+    *,
+    count: int = 64,
+    width: int = 64,
+    height: int = 64,
+    formats: Sequence[int] = SILVERDB_FORMATS,
+    seed: int = 0
+) -> int:
+    """writes count PNGs the way unpack_silverdb names them, formats taken in turn. returns the pixel count."""
+    rng = np.random.default_rng(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    for index in range(count):
+        image_format = formats[index % len(formats)]
+        _pixels(rng, image_format, width, height).save(directory / f"{1000 + index}_{image_format:04x}.png")
+
+    return count * width * height
+
+
+def make_silverdb(path: Path, source_directory: Path, **kwargs):
+    """generates a directory of PNGs and packs it, kwargs go to make_silverdb_directory"""
+    make_silverdb_directory(source_directory, **kwargs)
+    with open(path, "wb") as stream:
+        pack_silverdb(stream, source_directory, write_manifest=False)
+
+
+def make_img1_directory(directory: Path, *, body_size: int = 0x100000, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    with open(directory / "head.json", "w", encoding="utf-8") as head_stream:
+        json.dump({
+            "magic": "8723",
+            "version": "2.0",
+            "signature_format": 3,
+            "entry_point": 0,
+            "salt": int.from_bytes(rng.bytes(32), "little"),
+            "unk0": 0,
+            "unk1": 0,
+            "header_signature": int.from_bytes(rng.bytes(16), "little"),
+            "header_leftover": 0
+        }, fp=head_stream, indent=2)
+
+    (directory / "body.bin").write_bytes(rng.bytes(body_size))
+    (directory / "sign.bin").write_bytes(rng.bytes(0x80))
+    (directory / "cert.bin").write_bytes(rng.bytes(CERT_LENGTH))
+
+
+def make_img1(path: Path, source_directory: Path, **kwargs):
+    """generates an unpacked IMG1 and packs it, kwargs go to make_img1_directory"""
+    make_img1_directory(source_directory, **kwargs)
+    with open(path, "wb") as stream:
+        pack_img1(stream, source_directory)
+
+
+def make_mse_directory(
+    directory: Path,
+    work_directory: Path,
+    *,
+    image_types: Iterable[str] = MSE_TYPES,
+    body_size: int = 0x100000,
+    seed: int = 0
+) -> int:
+    """writes one IMG1 per image type, work_directory holds their unpacked sources. returns the image count."""
+    directory.mkdir(parents=True, exist_ok=True)
+
+    count = 0
+    for index, image_type in enumerate(image_types):
+        make_img1(
+            directory / f"{image_type}.img1",
+            work_directory / image_type,
+            body_size=body_size,
+            seed=seed + index
+        )
+        count += 1
+
+    return count
+
+
+def make_mse(path: Path, work_directory: Path, *, device: Literal[6, 7] = 6, **kwargs):
+    """generates and packs a whole MSE, kwargs go to make_mse_directory"""
+    make_mse_directory(work_directory / "mse", work_directory / "img1", **kwargs)
+    with open(path, "wb") as stream:
+        pack_mse(stream, work_directory / "mse", device=device)
@@ -0,0 +1,377 @@
+from __future__ import annotations
+from typing import Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+import argparse
+import logging
+import json
+import time
+import sys
+import os
+
+# only the standard library up here, the format packages (and Pillow with them) are imported by the jobs that need them
+
+MSE_MAGIC = b"{{~~"
+ZIP_MAGIC = b"PK\x03\x04"  # an IPSW, read as the Firmware.MSE inside it
+IMG1_VERSION = b"2.0"
+SILVERDB_MAGIC = b"\x03\x00\x00\x00"
+
+PACKED_SUFFIXES = {"mse": ".MSE", "img1": ".img1", "silverdb": ".silverdb"}
+
+
+def detect_kind(path: Path) -> str:
+    """"mse", "img1" or "silverdb" for a packed file or an unpacked directory"""
+    if path.is_dir():
+        if any(path.glob("*.img1")):
+            return "mse"
+        if (path / "head.json").exists() and (path / "body.bin").exists():
+            return "img1"
+        return "silverdb"
+
+    with open(path, "rb") as stream:
+        magic = stream.read(8)
+
+    if magic.startswith(MSE_MAGIC) or magic.startswith(ZIP_MAGIC):
+        return "mse"
+    elif magic[4:7] == IMG1_VERSION:
+        return "img1"
+    elif magic.startswith(SILVERDB_MAGIC):
+        return "silverdb"
+    else:
+        raise ValueError(f"not an MSE, IMG1 or SilverDB: {path}")
+
+
+@dataclass
+class Job:
+    command: str  # "unpack" or "pack"
+    source: Path
+    destination: Path  # for pack without the suffix, that depends on the format detected in the job
+    options: Dict[str, object] = field(default_factory=dict)
+
+
+@dataclass
+class JobResult:
+    job: Job
+    kind: Optional[str]
+    seconds: float
+    length: int  # bytes of the packed side
+    destination: Path  # where the output went, or would have
+    error: Optional[str] = None
+    profile: Optional[dict] = None  # Recorder.to_json() when asked for
+
+
+def _unpack(source: Path, destination: Path, kind: str, options: dict, instrument) -> int:
+    destination.mkdir(parents=True, exist_ok=True)
+
+    if kind == "mse" and options.get("slot"):
+        from .pipeline import unpack_resources
+        unpack_resources(
+            source, destination,
+            image_type=options["slot"], raw=options["raw"], previews=options["previews"], instrument=instrument
+        )
+        return source.stat().st_size
+
+    with open(source, "rb") as stream:
+        if kind == "mse":
+            from .mse import unpack_mse
+            unpack_mse(stream, destination, instrument=instrument)
+        elif kind == "img1":
+            from .img1 import unpack_img1
+            unpack_img1(stream, destination, instrument=instrument)
+        else:
+            from .silverdb import unpack_silverdb
+            unpack_silverdb(
+                stream, destination,
+                raw=options["raw"], previews=options["previews"], language=options["language"], instrument=instrument
+            )
+
+    return source.stat().st_size
+
+
+def _pack(source: Path, destination: Path, kind: str, options: dict, instrument) -> int:
+    if kind == "mse" and options.get("device") is None:
+        raise ValueError("packing an MSE needs --device")
+    if destination.exists() and not options.get("force"):
+        # e.g. the Firmware.MSE that Firmware/ was unpacked from
+        raise ValueError(f"{destination} already exists, pass --force to overwrite it")
+
+    # written under a temporary name and only moved into place once packing worked, so a failure leaves nothing
+    # behind and a file being replaced with --force survives it
+    temp_path = destination.with_name(f".{destination.name}.tmp")
+    try:
+        with open(temp_path, "wb") as stream:
+            if kind == "mse":
+                from .mse import pack_mse
+                pack_mse(stream, source, device=options["device"], instrument=instrument)
+            elif kind == "img1":
+                from .img1 import pack_img1
+                pack_img1(stream, source)
+            else:
+                from .silverdb import pack_silverdb
+                pack_silverdb(stream, source, language=options["language"], instrument=instrument)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    os.replace(temp_path, destination)
+
+    return destination.stat().st_size
+
+
+def run_job(job: Job) -> JobResult:
+    # runs in a worker process, errors come back as text so one bad file doesn't stop the rest
+    from .instrument import Recorder
+
+    recorder = Recorder() if job.options.get("profile") else None
+    start = time.perf_counter()
+    kind = None
+    destination = job.destination
+    try:
+        if job.command == "unpack":
+            kind = detect_kind(job.source)
+            length = _unpack(job.source, destination, kind, job.options, recorder)
+        else:
+            if not job.source.is_dir():
+                raise ValueError(f"only unpacked directories can be packed: {job.source}")
+            kind = detect_kind(job.source)
+            destination = destination.with_name(f"{destination.name}{PACKED_SUFFIXES[kind]}")
+            length = _pack(job.source, destination, kind, job.options, recorder)
+    except Exception as exception:
+        return JobResult(
+            job, kind, time.perf_counter() - start, 0, destination, error=f"{type(exception).__name__}: {exception}"
+        )
+
+    return JobResult(
+        job, kind, time.perf_counter() - start, length, destination,
+        profile=None if recorder is None else recorder.to_json()
+    )
+
+
+def _init_worker(level: int):
+    logging.basicConfig(level=level, format="%(processName)s %(name)s: %(message)s")
+
+
+def run_jobs(jobs: List[Job], *, processes: int, level: int) -> List[JobResult]:
+    results = []
+
+    def report(result: JobResult):
+        results.append(result)
+        status = f"failed, {result.error}" if result.error else f"{result.seconds:.2f}s"
+        print(f"[{len(results)}/{len(jobs)}] {result.job.source} -> {result.destination} {status}", flush=True)
+
+    if processes <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            report(run_job(job))
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(level,)) as executor:
+            for future in as_completed([executor.submit(run_job, job) for job in jobs]):
+                report(future.result())
+
+    return results
+
+
+def print_summary(results: List[JobResult], wall_seconds: float):
+    print()
+    print(f"{'file':<40} {'kind':<9} {'seconds':>8} {'MB':>9} {'MB/s':>8}")
+    for result in sorted(results, key=lambda result: str(result.job.source)):
+        name = str(result.job.source)
+        if len(name) > 40:
+            name = "..." + name[-37:]
+
+        if result.error:
+            print(f"{name:<40} {result.kind or '?':<9} {result.seconds:8.2f} {'failed':>9}")
+        else:
+            megabytes = result.length / 1e6
+            print(f"{name:<40} {result.kind:<9} {result.seconds:8.2f} {megabytes:9.1f} {megabytes / result.seconds:8.1f}")
+
+    failed = sum(1 for result in results if result.error)
+    busy_seconds = sum(result.seconds for result in results)
+    print(
+        f"{len(results) - failed} done, {failed} failed in {wall_seconds:.2f}s "
+        f"({busy_seconds:.2f}s of work, {busy_seconds / max(wall_seconds, 1e-9):.1f}x parallel)"
+    )
+
+
+def output_names(sources: List[Path]) -> List[str]:
+    # Firmware.MSE from a dozen IPSWs would all land in Firmware/, so clashing names get their parent directory too
+    names = [source.name if source.is_dir() else source.stem for source in sources]
+    clashing = {name for name in names if names.count(name) > 1}
+    names = [
+        f"{source.resolve().parent.name}_{name}" if name in clashing else name
+        for source, name in zip(sources, names)
+    ]
+
+    if len(set(names)) != len(names):
+        raise ValueError("inputs would overwrite each other, give them separate --output directories")
+    return names
+
+
+def _info_mse(path: Path) -> List[str]:
+    from .mse.reader import MseArchive, detect_device
+
+    with MseArchive.open(path) as archive:
+        lines = [f"MSE, nano {detect_device(archive)}g, {len(archive)} images"]
+        for image in archive.images:
+            lines.append(
+                f"  {image.type} {image.target} offset=0x{image.data_offset:08x} length=0x{image.data_length:08x} "
+                f"load_address=0x{image.load_address:08x} version=0x{image.version:x}"
+            )
+    return lines
+
+
+def _info_img1(path: Path) -> List[str]:
+    from .img1 import Img1
+
+    with Img1.open(path) as image:
+        header = image.header
+        return [
+            f"IMG1 {header.version}, SoC {header.magic}, signature format {header.signature_format}",
+            f"  entry_point=0x{header.entry_point:08x} body_length=0x{header.body_length:08x} "
+            f"footer_length=0x{header.footer_length:08x}"
+        ]
+
+
+def _info_silverdb(path: Path) -> List[str]:
+    from .silverdb.reader import SilverDBFile
+    from .silverdb.unpack import IMAGE_HEADER_LENGTH, parse_image_header
+
+    with SilverDBFile.open(path) as database:
+        lines = [f"SilverDB {database.table_type_str}, {len(database)} files"]
+
+        if database.table_type_str == "paMB":
+            formats: Dict[int, int] = {}
+            empty = 0
+            for file_id in database:
+                data = database.raw(file_id)
+                if len(data) < IMAGE_HEADER_LENGTH:
+                    empty += 1
+                else:
+                    image_format = parse_image_header(data[:IMAGE_HEADER_LENGTH]).image_format
+                    formats[image_format] = formats.get(image_format, 0) + 1
+                data.release()
+
+            lines.append("  " + ", ".join(f"{count}x {image_format:04x}" for image_format, count in sorted(formats.items())))
+            if empty > 0:
+                lines.append(f"  {empty} empty")
+
+    return lines
+
+
+def info(path: Path) -> List[str]:
+    kind = detect_kind(path)
+    if path.is_dir():
+        return [f"unpacked {kind}"]
+    elif kind == "mse":
+        return _info_mse(path)
+    elif kind == "img1":
+        return _info_img1(path)
+    else:
+        return _info_silverdb(path)
+
+
+def _parse_replacements(values: List[str]) -> Dict[int, Path]:
+    replacements = {}
+    for value in values:
+        image_id, path = value.split("=", 1)
+        replacements[int(image_id)] = Path(path)
+    return replacements
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m ipodhax")
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="-v logs what is happening, -vv every image")
+    parser.add_argument("--profile", type=Path, help="write stage and image timings of every file here as json")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    unpack_parser = subparsers.add_parser("unpack", help="unpack MSE, IMG1 and SilverDB files, the format is detected")
+    unpack_parser.add_argument("inputs", nargs="+", type=Path)
+    unpack_parser.add_argument("-o", "--output", type=Path, help="where the directories go, next to each input by default")
+    unpack_parser.add_argument("-j", "--jobs", type=int, default=1, help="files unpacked at once")
+    unpack_parser.add_argument("--slot", help="for an MSE, unpack the SilverDB inside this slot (usually rsrc) instead")
+    unpack_parser.add_argument("--raw", action="store_true", help="write SilverDB raw records instead of PNGs")
+    unpack_parser.add_argument("--previews", action="store_true", help="write PNGs next to raw records")
+    unpack_parser.add_argument(
+        "--language", action="store_true", help="unpack mTDL language databases as text too, their layout is a guess"
+    )
+
+    pack_parser = subparsers.add_parser("pack", help="pack unpacked directories, the format is detected")
+    pack_parser.add_argument("inputs", nargs="+", type=Path)
+    pack_parser.add_argument("-o", "--output", type=Path, help="where the files go, next to each input by default")
+    pack_parser.add_argument("-j", "--jobs", type=int, default=1, help="directories packed at once")
+    pack_parser.add_argument("--device", type=int, choices=[6, 7], help="needed for MSE")
+    pack_parser.add_argument("--force", action="store_true", help="overwrite packed files that are already there")
+    pack_parser.add_argument(
+        "--language", action="store_true", help="pack directories unpacked from mTDL language databases, their layout is a guess"
+    )
+
+    info_parser = subparsers.add_parser("info", help="describe MSE, IMG1 and SilverDB files")
+    info_parser.add_argument("inputs", nargs="+", type=Path)
+
+    replace_parser = subparsers.add_parser("replace", help="replace SilverDB images and rebuild the whole Firmware.MSE")
+    replace_parser.add_argument("mse", type=Path)
+    replace_parser.add_argument("output", help="output MSE, - for stdout")
+    replace_parser.add_argument("replacements", nargs="+", metavar="ID=PNG")
+    replace_parser.add_argument("--slot", default="rsrc", help="slot holding the SilverDB")
+    replace_parser.add_argument("--device", type=int, choices=[6, 7], help="detected from the input by default")
+
+    args = parser.parse_args(argv)
+
+    # logging goes to stderr, so writing the firmware to stdout stays clean
+    level = logging.DEBUG if args.verbose > 1 else logging.INFO if args.verbose == 1 else logging.WARNING
+    logging.basicConfig(level=level, format="%(name)s: %(message)s")
+
+    if args.command == "info":
+        failed = False
+        for path in args.inputs:
+            try:
+                lines = info(path)
+            except (OSError, ValueError) as exception:
+                print(f"{path}: {exception}", file=sys.stderr)
+                failed = True
+            else:
+                print(f"{path}: " + "\n".join(lines))
+        return 1 if failed else 0
+
+    if args.command == "replace":
+        from .pipeline import replace_resources
+
+        replacements = _parse_replacements(args.replacements)
+        if args.output == "-":
+            replace_resources(args.mse, sys.stdout.buffer, replacements, image_type=args.slot, device=args.device)
+        else:
+            with open(args.output, "wb") as output_stream:
+                replace_resources(args.mse, output_stream, replacements, image_type=args.slot, device=args.device)
+        return 0
+
+    names = output_names(args.inputs)
+    jobs = []
+    for source, name in zip(args.inputs, names):
+        directory = args.output if args.output is not None else source.parent
+        if args.command == "unpack":
+            jobs.append(Job("unpack", source, directory / name, {
+                "slot": args.slot, "raw": args.raw, "previews": args.previews, "language": args.language,
+                "profile": args.profile is not None
+            }))
+        else:
+            jobs.append(Job("pack", source, directory / name, {
+                "device": args.device, "force": args.force, "language": args.language, "profile": args.profile is not None
+            }))
+
+    if args.output is not None:
+        args.output.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    results = run_jobs(jobs, processes=args.jobs, level=level)
+    print_summary(results, time.perf_counter() - start)
+
+    if args.profile is not None:
+        with open(args.profile, "w", encoding="utf-8") as profile_stream:
+            json.dump({
+                str(result.job.source): result.profile for result in results if result.profile is not None
+            }, fp=profile_stream, indent=2)
+
+    return 1 if any(result.error for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from pathlib import Path
+import hashlib
+import logging
+import json
+import mmap
+import time
+import os
+
+from .instrument import Instrument, instrument_or_null
+
+DIGESTS_NAME = "digests.json"  # not manifest.json, that one is the SilverDB manifest and an unpack can share a directory with it
+WRITE_CHUNK_SIZE = 0x1000000  # how much of one output a single worker writes at a time
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OutputDigest:
+    name: str  # file name inside the unpacked directory
+    hash: str  # sha256 of what was written
+    size: int
+    mtime: int  # of the written file in nanoseconds, so a file edited since shows up without hashing it
+
+
+def sha256(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def digest_views(views: Dict[str, memoryview], *, workers: Optional[int] = None) -> Dict[str, str]:
+    """
+    sha256 of every view, several at once. hashlib lets go of the GIL for anything bigger than a couple of KB,
+    so threads hashing slices of one memory map really do run in parallel.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(views, executor.map(sha256, views.values())))
+
+
+def _digest_file(path: Path) -> Optional[str]:
+    try:
+        with open(path, "rb") as stream:
+            if os.fstat(stream.fileno()).st_size == 0:
+                return sha256(b"")  # empty files can't be mapped
+            with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                return sha256(mapping)
+    except FileNotFoundError:
+        return None
+
+
+def digest_files(paths: Dict[str, Path], *, workers: Optional[int] = None) -> Dict[str, Optional[str]]:
+    """like digest_views for files on disk, None for the ones that don't exist"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(paths, executor.map(_digest_file, paths.values())))
+
+
+def load_digests(directory: Path) -> Dict[str, OutputDigest]:
+    path = directory / DIGESTS_NAME
+    if not path.exists():
+        return {}
+
+    try:
+        with open(path, "r", encoding="utf-8") as manifest_stream:
+            data = json.load(manifest_stream)
+        return {entry["name"]: OutputDigest(**entry) for entry in data["outputs"]}
+    except (ValueError, KeyError, TypeError):
+        # only a cache, everything gets written again and the file replaced
+        logger.warning("ignoring %s, it is not a list of output digests", path)
+        return {}
+
+
+def save_digests(directory: Path, entries: List[OutputDigest]):
+    path = directory / DIGESTS_NAME
+    temp_path = path.with_name(f".{DIGESTS_NAME}.tmp")
+
+    with open(temp_path, "w", encoding="utf-8") as manifest_stream:
+        json.dump({
+            "outputs": [asdict(entry) for entry in sorted(entries, key=lambda entry: entry.name)]
+        }, fp=manifest_stream, indent=2)
+
+    os.replace(temp_path, path)
+
+
+def _file_unchanged(entry: Optional[OutputDigest], path: Path) -> bool:
+    # the output has to be exactly as we left it, only then is it worth hashing the source to compare
+    if entry is None:
+        return False
+
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return False
+
+    return stat.st_size == entry.size and stat.st_mtime_ns == entry.mtime
+
+
+def output_unchanged(entry: Optional[OutputDigest], path: Path, digest: str) -> bool:
+    # the source has to hash the same and the output has to be exactly as we left it
+    return entry is not None and entry.hash == digest and _file_unchanged(entry, path)
+
+
+def _write_file(path: Path, data: memoryview) -> os.stat_result:
+    with open(path, "wb") as output_stream:
+        output_stream.write(data)
+    return path.stat()
+
+
+def write_output(
+    directory: Path,
+    name: str,
+    data: memoryview,
+    digest: str,
+    entry: Optional[OutputDigest],
+    instrument: Instrument,
+    stage: str
+) -> Tuple[OutputDigest, bool]:
+    """writes one output unless entry says it is already there, returns its new entry and whether it was written"""
+    path = directory / name
+    if output_unchanged(entry, path, digest):
+        logger.debug("%s is unchanged", name)
+        return entry, False
+
+    logger.info("writing %s", name)
+    start = time.perf_counter()
+    stat = _write_file(path, data)
+    instrument.image(stage, path.stem, time.perf_counter() - start, len(data))
+    return OutputDigest(name=name, hash=digest, size=stat.st_size, mtime=stat.st_mtime_ns), True
+
+
+def _write_chunk(descriptor: int, data: memoryview, offset: int) -> float:
+    # positioned, so any number of these can share a descriptor. os.pwrite can stop short, hence the loop
+    start = time.perf_counter()
+    while len(data) > 0:
+        written = os.pwrite(descriptor, data, offset)
+        data = data[written:]
+        offset += written
+    return time.perf_counter() - start
+
+
+def _write_outputs_parallel(
+    directory: Path,
+    outputs: Dict[str, memoryview],
+    names: List[str],
+    workers: int,
+    instrument: Instrument,
+    stage: str
+) -> Dict[str, os.stat_result]:
+    """
+    writes names out of outputs with a pool of threads, each output split into WRITE_CHUNK_SIZE pieces,
+    so a big IMG1 is written by several workers at once and the small ones go next to it
+    """
+    stats = {}
+    descriptors: Dict[str, int] = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            chunks = {}
+            for name in names:
+                logger.info("writing %s", name)
+                data = outputs[name]
+                flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+                descriptors[name] = os.open(directory / name, flags, 0o666)
+                chunks[name] = [
+                    executor.submit(_write_chunk, descriptors[name], data[offset:offset + WRITE_CHUNK_SIZE], offset)
+                    for offset in range(0, len(data), WRITE_CHUNK_SIZE)
+                ]
+
+            for done, name in enumerate(names, start=1):
+                seconds = sum(chunk.result() for chunk in chunks[name])
+                os.close(descriptors.pop(name))
+
+                path = directory / name
+                stats[name] = path.stat()
+                instrument.image(stage, path.stem, seconds, len(outputs[name]))
+                instrument.progress(stage, done, len(names))
+    finally:
+        for descriptor in descriptors.values():
+            os.close(descriptor)
+
+    return stats
+
+
+def _write_outputs_serial(
+    directory: Path,
+    outputs: Dict[str, memoryview],
+    names: List[str],
+    instrument: Instrument,
+    stage: str
+) -> Dict[str, os.stat_result]:
+    stats = {}
+    for done, name in enumerate(names, start=1):
+        logger.info("writing %s", name)
+        start = time.perf_counter()
+        stats[name] = _write_file(directory / name, outputs[name])
+        instrument.image(stage, Path(name).stem, time.perf_counter() - start, len(outputs[name]))
+        instrument.progress(stage, done, len(names))
+    return stats
+
+
+def write_outputs(
+    directory: Path,
+    outputs: Dict[str, memoryview],
+    *,
+    workers: Optional[int] = None,
+    instrument: Optional[Instrument] = None,
+    stage: str = "extract"
+) -> List[str]:
+    """
+    writes each output as directory / name, skipping the ones the manifest says are already there.
+    more than one worker writes them in parallel with positioned writes, see _write_outputs_parallel.
+    returns the names that were written.
+    """
+    instrument = instrument_or_null(instrument)
+    manifest = load_digests(directory)
+
+    # only an output whose file still looks the way the manifest left it needs its hash before deciding.
+    # everything else is written straight away, hashed by a pool next to the writes for the new manifest
+    candidates = [name for name in outputs if _file_unchanged(manifest.get(name), directory / name)]
+    with ThreadPoolExecutor(max_workers=workers) as hasher:
+        digests = {name: hasher.submit(sha256, outputs[name]) for name in candidates}
+        digests.update((name, hasher.submit(sha256, data)) for name, data in outputs.items() if name not in digests)
+
+        entries = {}
+        for name in candidates:
+            if digests[name].result() == manifest[name].hash:
+                logger.debug("%s is unchanged", name)
+                entries[name] = manifest[name]
+        written = [name for name in outputs if name not in entries]
+
+        with instrument.timed(stage) as timed_stage:
+            if workers is not None and workers > 1 and hasattr(os, "pwrite"):
+                stats = _write_outputs_parallel(directory, outputs, written, workers, instrument, stage)
+            else:
+                stats = _write_outputs_serial(directory, outputs, written, instrument, stage)
+            timed_stage.length = sum(len(outputs[name]) for name in written)
+
+        for name, stat in stats.items():
+            entries[name] = OutputDigest(name=name, hash=digests[name].result(), size=stat.st_size, mtime=stat.st_mtime_ns)
+
+    save_digests(directory, list(entries.values()))
+    return written
+
+
+def verify_outputs(directory: Path, outputs: Dict[str, memoryview], *, workers: Optional[int] = None) -> List[str]:
+    """names of the outputs whose file in directory is missing or differs from what unpacking would write"""
+    expected = digest_views(outputs, workers=workers)
+    actual = digest_files({name: directory / name for name in outputs}, workers=workers)
+    return [name for name in outputs if actual[name] != expected[name]]
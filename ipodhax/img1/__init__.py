@@ -1,2 +1,3 @@
 from .pack import pack_img1
-from .unpack import unpack_img1
+from .unpack import unpack_img1, verify_img1
+from .image import Img1
@@ -0,0 +1,143 @@
+from __future__ import annotations
+from typing import BinaryIO
+from dataclasses import dataclass, replace
+
+from ..schema import IMG1_HEADER
+from ..utils import MappedBuffer, ViewReader
+
+HEADER_LENGTH = IMG1_HEADER.size  # 0x54
+BODY_OFFSET = 0x400  # change to 600 for other SoC
+SIGNATURE_LENGTH = 0x80
+FOOTER_PADDING = 0x800
+
+
+@dataclass
+class Img1Header:
+    __slots__ = (
+        "magic", "version", "signature_format", "entry_point", "body_length", "data_length",
+        "footer_offset", "footer_length", "salt", "unk0", "unk1", "header_signature", "header_leftover"
+    )
+
+    magic: str
+    version: str
+    signature_format: int
+    entry_point: int  # (relative to header end)
+    body_length: int
+    data_length: int  # inferred
+    footer_offset: int  # inferred
+    footer_length: int
+    salt: int
+    unk0: int
+    unk1: int
+    header_signature: int
+    header_leftover: int
+
+    @classmethod
+    def parse(cls, data: bytes) -> Img1Header:
+        header = cls(*IMG1_HEADER.unpack(data))
+        if header.version != "2.0":
+            raise ValueError("unsupported img1 version")
+        return header
+
+    @classmethod
+    def from_json(cls, header_data: dict, body_length: int, cert_length: int) -> Img1Header:
+        # head.json only keeps what can't be worked out from the section sizes
+        return cls(
+            magic=header_data["magic"],
+            version=header_data["version"],
+            signature_format=header_data["signature_format"],
+            entry_point=header_data["entry_point"],
+            body_length=body_length,
+            data_length=body_length + cert_length + SIGNATURE_LENGTH,
+            footer_offset=body_length + SIGNATURE_LENGTH,
+            footer_length=cert_length,
+            salt=header_data["salt"],
+            unk0=header_data["unk0"],
+            unk1=header_data["unk1"],
+            header_signature=header_data["header_signature"],
+            header_leftover=header_data["header_leftover"]
+        )
+
+    def to_json(self) -> dict:
+        return {
+            "magic": self.magic,
+            "version": self.version,
+            "signature_format": self.signature_format,
+            "entry_point": self.entry_point,
+            "salt": self.salt,
+            "unk0": self.unk0,
+            "unk1": self.unk1,
+            "header_signature": self.header_signature,
+            "header_leftover": self.header_leftover
+        }
+
+    def pack(self) -> bytes:
+        return IMG1_HEADER.pack(*(getattr(self, name) for name in IMG1_HEADER.names))
+
+
+class Img1(MappedBuffer):
+    """
+    an IMG1 held in memory. parsed from a buffer or memory map, the sections are views into it until replaced,
+    e.g. img1.body = patched_body.
+    """
+
+    def __init__(self, header: Img1Header, body, signature, certificate):
+        self.header = header
+        self.body = body
+        self.signature = signature
+        self.certificate = certificate
+
+    @classmethod
+    def parse(cls, buffer) -> Img1:
+        view = memoryview(buffer)
+        header = Img1Header.parse(view[:HEADER_LENGTH])
+
+        body_end = BODY_OFFSET + header.body_length
+        signature_end = body_end + SIGNATURE_LENGTH  # this makes an assumption and ignores footer_offset
+        return cls(
+            header=header,
+            body=view[BODY_OFFSET:body_end],
+            signature=view[body_end:signature_end],
+            certificate=view[signature_end:signature_end + header.footer_length]
+        )
+
+    @classmethod
+    def _from_buffer(cls, buffer) -> Img1:
+        return cls.parse(buffer)
+
+    @classmethod
+    def from_stream(cls, stream: BinaryIO) -> Img1:
+        if isinstance(stream, ViewReader):
+            # already in memory, e.g. a slot of an MseArchive
+            return cls.parse(stream.view)
+        return super().from_stream(stream)
+
+    def close(self):
+        # views of the sections that were handed out must be released before this
+        for section in (self.body, self.signature, self.certificate):
+            if isinstance(section, memoryview):
+                section.release()
+        super().close()
+
+    def updated_header(self) -> Img1Header:
+        """the header with lengths matching the current sections"""
+        body_length = len(self.body)
+        cert_length = len(self.certificate)
+        return replace(
+            self.header,
+            body_length=body_length,
+            data_length=body_length + cert_length + SIGNATURE_LENGTH,
+            footer_offset=body_length + SIGNATURE_LENGTH,
+            footer_length=cert_length
+        )
+
+    def write(self, stream: BinaryIO):
+        if len(self.signature) != SIGNATURE_LENGTH:
+            raise ValueError(f"signature must be {SIGNATURE_LENGTH} bytes")
+
+        stream.write(self.updated_header().pack())
+        stream.write(bytes(BODY_OFFSET - HEADER_LENGTH))
+        stream.write(self.body)
+        stream.write(self.signature)
+        stream.write(self.certificate)
+        stream.write(bytes(FOOTER_PADDING))
@@ -0,0 +1,80 @@
+from __future__ import annotations
+from typing import Iterator, List, Optional, Union
+from dataclasses import dataclass, asdict
+import contextlib
+import time
+
+ImageId = Union[int, str]  # SilverDB ids are numbers, MSE slots go by their type
+
+
+class Instrument:
+    """
+    receives timings and progress from the pack and unpack functions, which all take one as instrument=.
+    every method does nothing here, override the ones you care about.
+    """
+
+    def stage(self, name: str, seconds: float, length: int):
+        """a whole stage finished, length is the bytes it read or wrote"""
+
+    def image(self, stage: str, image_id: ImageId, seconds: float, length: int):
+        """one image of a stage finished"""
+
+    def progress(self, stage: str, done: int, total: int):
+        """done out of total images of a stage are finished, not necessarily after every single one"""
+
+    @contextlib.contextmanager
+    def timed(self, name: str) -> Iterator[Stage]:
+        stage = Stage(name)
+        start = time.perf_counter()
+        yield stage
+        self.stage(name, time.perf_counter() - start, stage.length)
+
+
+class Stage:
+    __slots__ = ("name", "length")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.length = 0  # add to this as bytes go through
+
+
+NULL_INSTRUMENT = Instrument()
+
+
+@dataclass
+class StageRecord:
+    name: str
+    seconds: float
+    length: int
+
+
+@dataclass
+class ImageRecord:
+    stage: str
+    id: ImageId
+    seconds: float
+    length: int
+
+
+class Recorder(Instrument):
+    """keeps every timing it gets, for dumping as json afterwards"""
+
+    def __init__(self):
+        self.stages: List[StageRecord] = []
+        self.images: List[ImageRecord] = []
+
+    def stage(self, name: str, seconds: float, length: int):
+        self.stages.append(StageRecord(name, seconds, length))
+
+    def image(self, stage: str, image_id: ImageId, seconds: float, length: int):
+        self.images.append(ImageRecord(stage, image_id, seconds, length))
+
+    def to_json(self, *, images: bool = True) -> dict:
+        data = {"stages": [asdict(record) for record in self.stages]}
+        if images:
+            data["images"] = [asdict(record) for record in self.images]
+        return data
+
+
+def instrument_or_null(instrument: Optional[Instrument]) -> Instrument:
+    return NULL_INSTRUMENT if instrument is None else instrument
@@ -1,2 +1,4 @@
 from .pack import pack_mse
-from .unpack import unpack_mse
+from .unpack import unpack_mse, verify_mse
+from .reader import MseArchive
+from .patch import patch_mse
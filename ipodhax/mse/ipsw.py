@@ -0,0 +1,62 @@
+from typing import BinaryIO, Optional, Tuple, Union
+import zipfile
+import mmap
+import io
+
+from ..utils import CachedReader
+
+ZIP_MAGIC = b"PK\x03\x04"
+MSE_NAME = "firmware.mse"
+LOCAL_HEADER_LENGTH = 30
+
+
+def is_zip(stream: BinaryIO) -> bool:
+    position = stream.tell()
+    magic = stream.read(4)
+    stream.seek(position)
+    return magic == ZIP_MAGIC
+
+
+def find_mse(archive: zipfile.ZipFile) -> zipfile.ZipInfo:
+    members = [info for info in archive.infolist() if info.filename.rsplit("/", 1)[-1].lower() == MSE_NAME]
+    if len(members) == 0:
+        raise ValueError("no Firmware.MSE in this IPSW")
+    return members[0]
+
+
+def _data_offset(mapping: mmap.mmap, info: zipfile.ZipInfo) -> int:
+    # the local header repeats the name and can have its own extra field, so the data offset is only known from there
+    header = mapping[info.header_offset:info.header_offset + LOCAL_HEADER_LENGTH]
+    if header[0:4] != ZIP_MAGIC:
+        raise ValueError("bad zip local header")
+
+    name_length = int.from_bytes(header[26:28], "little")
+    extra_length = int.from_bytes(header[28:30], "little")
+    return info.header_offset + LOCAL_HEADER_LENGTH + name_length + extra_length
+
+
+def open_mse(
+    stream: BinaryIO,
+    *,
+    cache_blocks: int = 16
+) -> Tuple[Union[memoryview, CachedReader], Optional[mmap.mmap]]:
+    """
+    finds Firmware.MSE in an IPSW. a stored member comes back as (view, mmap), a slice of the mapped zip that
+    copies nothing. anything else comes back as (CachedReader, None), decompressed as it is read.
+    """
+    archive = zipfile.ZipFile(stream)
+    info = find_mse(archive)
+
+    if info.compress_type == zipfile.ZIP_STORED and info.flag_bits & 0x1 == 0:
+        try:
+            mapping = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, io.UnsupportedOperation):
+            mapping = None
+
+        if mapping is not None:
+            archive.close()
+            start = _data_offset(mapping, info)
+            return memoryview(mapping)[start:start + info.file_size], mapping
+
+    # the reader closes the member, the zip has to stay open until then and goes when stream does
+    return CachedReader(archive.open(info), info.file_size, cache_blocks=cache_blocks), None
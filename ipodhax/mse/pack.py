@@ -1,7 +1,9 @@
-from typing import BinaryIO, Literal
+from typing import BinaryIO, Dict, Literal, Optional, Union
 from pathlib import Path
-import io
+import time
 
+from ..instrument import Instrument, instrument_or_null
+from ..schema import MSE_SLOT
 from ..utils import buffered_copy
 
 ROOT_DIR = Path(__file__).parent
@@ -42,23 +44,35 @@ N6G_LOAD_ADDRESSES = {
 
 TYPES = set(TYPE_ORDER)
 
+ImageSource = Union[Path, bytes, bytearray, memoryview]
+
 OFFSET = 0x5000
 
 
-def pack_mse(stream: BinaryIO, directory: Path, *, device: Literal[6, 7]):
+def _source_length(source: ImageSource) -> int:
+    return source.stat().st_size if isinstance(source, Path) else len(source)
+
+
+def write_mse(
+    stream: BinaryIO,
+    images: Dict[str, ImageSource],
+    *,
+    device: Literal[6, 7],
+    instrument: Optional[Instrument] = None
+):
+    """
+    writes an MSE in one forward pass. each IMG1 is either a path to copy from or a buffer already in memory.
+    """
+    instrument = instrument_or_null(instrument)
+
     if device not in {6, 7}:
         raise ValueError("invalid device")
 
-    passed_image_types = [path.stem for path in directory.glob("*.img1") if not path.name.startswith(".")]
+    passed_image_types = list(images)
 
     with open(ROOT_DIR / "certificate.bin", "rb") as cert_stream:
         cert_data = cert_stream.read(2048)  # bad, not portable
 
-    stream.write(STOP_SIGN)
-    stream.write(UNK0)
-    # pad to offset
-    stream.write(bytes(OFFSET - stream.tell()))
-
     # order things the right way? (maybe unnecessary)
     image_type_order = []
     for possible_item in TYPE_ORDER:
@@ -68,66 +82,72 @@ def pack_mse(stream: BinaryIO, directory: Path, *, device: Literal[6, 7]):
             passed_image_types.remove(possible_item)
     image_type_order.extend(passed_image_types)
 
-    stream.write(bytes(0x1000))  # this will be overwritten later when we seek back to offset to write metadata
-
+    # work out the whole layout from file sizes first, so everything can be written in one forward pass
     metadata_pairs = []  # will contain (offset, length) pairs
-
+    file_lengths = []
+    offset = OFFSET + 0x1000
     for image_type in image_type_order:
-        # maybe this would be better if it was continuous and didn't seek around?
-
-        file_path = directory / f"{image_type}.img1"
-        with open(file_path, "rb") as file_stream:
-            file_stream.seek(0, io.SEEK_END)
-            file_length = file_stream.tell()
-            file_stream.seek(0)
-
-            start_offset = stream.tell()
-
-            if file_length > 0x1000000:
-                # for files larger than 16 MB use chunked copying
-                buffered_copy(
-                    source=file_stream,
-                    destination=stream,
-                    limit=file_length
-                )
-            else:
-                stream.write(file_stream.read(file_length))
-
-            stream.write(cert_data)
+        file_length = _source_length(images[image_type])
+        length = file_length + len(cert_data)
+        extra_bytes = 0x1000 - (length % 0x1000)  # pad to nearest 0x1000, always at least some
 
-            # pad to nearest 0x1000
-            end_offset = stream.tell()
-            extra_bytes = 0x1000 - (end_offset % 0x1000)
-            stream.write(bytes(extra_bytes))
+        file_lengths.append(file_length)
+        metadata_pairs.append((offset, length))
+        offset += length + extra_bytes
 
-            metadata_pairs.append((start_offset, end_offset - start_offset))
+    header = bytearray()
+    header.extend(STOP_SIGN)
+    header.extend(UNK0)
+    # pad to offset
+    header.extend(bytes(OFFSET - len(header)))
 
-    stream.seek(OFFSET)
     for index, (offset, file_length) in enumerate(metadata_pairs):
         image_type = image_type_order[index]
 
-        metadata_stream = bytearray()
-        metadata_stream.extend("NAND".encode("ascii")[::-1])
-        metadata_stream.extend(image_type.encode("ascii")[::-1])
-        metadata_stream.extend(b"\x00\x00\x00\x00")  # id
-
         dev_offset = offset - 0x1000
         length = file_length - 0x1000
         address = 0x8000000 if image_type in {"disk", "diag", "fv00", "osos"} else 0x0
         entry_offset = 0x400 if image_type == "rsrc" else 0x0
-        checksum = 0x0
         version = 0x0 if image_type == "rsrc" else 0x1e000
         load_address = N6G_LOAD_ADDRESSES[image_type] if device == 6 else 0xFFFFFFFF
 
-        metadata_stream.extend(int.to_bytes(dev_offset, 4, "little"))
-        metadata_stream.extend(int.to_bytes(length, 4, "little"))
-        metadata_stream.extend(int.to_bytes(address, 4, "little"))
-        metadata_stream.extend(int.to_bytes(entry_offset, 4, "little"))
-        metadata_stream.extend(int.to_bytes(checksum, 4, "little"))
-        metadata_stream.extend(int.to_bytes(version, 4, "little"))
-        metadata_stream.extend(int.to_bytes(load_address, 4, "little"))
-
-        stream.write(metadata_stream)
+        # id and checksum stay 0
+        header.extend(MSE_SLOT.pack(
+            "NAND", image_type, dev_offset, length, address, entry_offset, version, load_address
+        ))
 
     for _ in range(16 - len(metadata_pairs)):
-        stream.write((b"\x00" * 36) + (b"\xFF" * 4))
+        header.extend((b"\x00" * 36) + (b"\xFF" * 4))
+
+    # the rest of the table region stays empty
+    header.extend(bytes(OFFSET + 0x1000 - len(header)))
+    stream.write(header)
+
+    with instrument.timed("write") as stage:
+        for done, (image_type, file_length, (offset, length)) in enumerate(
+            zip(image_type_order, file_lengths, metadata_pairs), start=1
+        ):
+            start = time.perf_counter()
+
+            source = images[image_type]
+            if isinstance(source, Path):
+                with open(source, "rb") as file_stream:
+                    buffered_copy(
+                        source=file_stream,
+                        destination=stream,
+                        limit=file_length
+                    )
+            else:
+                stream.write(source)
+
+            stream.write(cert_data)
+            stream.write(bytes(0x1000 - (length % 0x1000)))
+
+            instrument.image("write", image_type, time.perf_counter() - start, file_length)
+            instrument.progress("write", done, len(image_type_order))
+            stage.length += file_length
+
+
+def pack_mse(stream: BinaryIO, directory: Path, *, device: Literal[6, 7], instrument: Optional[Instrument] = None):
+    images = {path.stem: path for path in directory.glob("*.img1") if not path.name.startswith(".")}
+    write_mse(stream, images, device=device, instrument=instrument)
@@ -0,0 +1,101 @@
+from typing import BinaryIO
+from pathlib import Path
+import logging
+import io
+
+from .pack import ImageSource, _source_length
+from .reader import OFFSET, SLOT_COUNT, SLOT_LENGTH, parse_image_metadata
+from ..schema import MSE_SLOT
+from ..utils import buffered_copy, COPY_BUFFER_SIZE
+
+CERT_LENGTH = 2048
+
+logger = logging.getLogger(__name__)
+
+
+def _move_tail(stream: BinaryIO, start: int, end: int, shift: int):
+    # moves [start, end) forward by shift, back to front so nothing is overwritten before it is read
+    buffer = memoryview(bytearray(COPY_BUFFER_SIZE))
+    position = end
+
+    while position > start:
+        chunk_start = max(start, position - COPY_BUFFER_SIZE)
+        chunk = buffer[:position - chunk_start]
+
+        stream.seek(chunk_start)
+        stream.readinto(chunk)
+        stream.seek(chunk_start + shift)
+        stream.write(chunk)
+
+        position = chunk_start
+
+
+def patch_mse(stream: BinaryIO, image_type: str, source: ImageSource):
+    """
+    replaces the IMG1 in one slot of an existing MSE, stream has to be open for reading and writing.
+    if the new image fits in the old one's padded region only that region and its table entry are written,
+    otherwise everything after it is moved along to make room.
+    """
+    stream.seek(OFFSET)
+    table = stream.read(SLOT_COUNT * SLOT_LENGTH)
+
+    slots = []  # (index, metadata) for every used slot
+    for image_index in range(SLOT_COUNT):
+        image = parse_image_metadata(table[image_index * SLOT_LENGTH:(image_index + 1) * SLOT_LENGTH])
+        if image is not None:
+            slots.append((image_index, image))
+
+    matches = [(index, image) for index, image in slots if image.type == image_type]
+    if len(matches) == 0:
+        raise ValueError(f"no {image_type} slot")
+    slot_index, image = matches[0]
+
+    stream.seek(0, io.SEEK_END)
+    file_end = stream.tell()
+
+    # the region runs up to wherever the next image starts
+    region_end = min(
+        [other.data_offset for _, other in slots if other.data_offset > image.data_offset],
+        default=file_end
+    )
+
+    # keep the certificate that is already there
+    stream.seek(image.data_offset + image.data_length)
+    cert_data = stream.read(CERT_LENGTH)
+
+    file_length = _source_length(source)
+    length = file_length + len(cert_data)
+    padded_length = length + 0x1000 - (length % 0x1000)  # pad to nearest 0x1000, always at least some
+    new_region_end = image.data_offset + padded_length
+
+    if new_region_end > region_end:
+        shift = new_region_end - region_end
+        logger.info("relocating %d bytes after %s by 0x%x", file_end - region_end, image_type, shift)
+        _move_tail(stream, region_end, file_end, shift)
+
+        # everything that moved needs its table entry updated
+        for other_index, other in slots:
+            if other.data_offset >= region_end:
+                stream.seek(OFFSET + other_index * SLOT_LENGTH + MSE_SLOT.offset("dev_offset"))
+                stream.write(MSE_SLOT.pack_field("dev_offset", other.dev_offset + shift))
+
+        region_end = new_region_end
+    else:
+        logger.info("patching %s in place", image_type)
+
+    stream.seek(image.data_offset)
+    if isinstance(source, Path):
+        with open(source, "rb") as file_stream:
+            buffered_copy(
+                source=file_stream,
+                destination=stream,
+                limit=file_length
+            )
+    else:
+        stream.write(source)
+
+    stream.write(cert_data)
+    stream.write(bytes(region_end - stream.tell()))
+
+    stream.seek(OFFSET + slot_index * SLOT_LENGTH + MSE_SLOT.offset("length"))
+    stream.write(MSE_SLOT.pack_field("length", length - 0x1000))
@@ -0,0 +1,155 @@
+from __future__ import annotations
+from typing import BinaryIO, Iterator, List, Literal, Optional
+from dataclasses import dataclass
+from pathlib import Path
+
+from .ipsw import is_zip, open_mse
+from ..schema import MSE_SLOT
+from ..utils import MappedBuffer, ViewReader
+
+OFFSET = 0x5000
+SLOT_COUNT = 16
+SLOT_LENGTH = MSE_SLOT.size
+
+
+@dataclass
+class ImageMetadata:
+    target: str  # "NAND", "NOR!", "flsh"
+    type: str  # "disk", "diag", "appl", "lbat", "bdsw", "chrg", "rsrc", "osos"
+
+    # id: int
+    dev_offset: int
+    length: int
+    address: int
+
+    entry_offset: int
+    # checksum: int
+    version: int
+    load_address: int
+
+    @property
+    def data_offset(self) -> int:
+        return self.dev_offset + 0x1000  # 4096 padding? unclear.
+
+    @property
+    def data_length(self) -> int:
+        return self.length + 0x800  # length does not include the 0x800 img1 header overhead
+
+
+def parse_image_metadata(image_data: bytes) -> Optional[ImageMetadata]:
+    if image_data[0:4] == b"\x00\x00\x00\x00":
+        # placeholder
+        return None
+
+    return ImageMetadata(*MSE_SLOT.unpack(image_data))
+
+
+class MseArchive(MappedBuffer):
+    """
+    the IMG1s inside an MSE as views of one buffer or memory map, nothing is copied until it is read.
+    can also sit on a seekable stream instead, e.g. Firmware.MSE deflated inside an IPSW, slots are read when asked for then.
+    """
+
+    def __init__(self, buffer=None, *, stream: Optional[BinaryIO] = None):
+        if (buffer is None) == (stream is None):
+            raise ValueError("needs either a buffer or a stream")
+
+        self._buffer = None if buffer is None else memoryview(buffer)
+        self._stream = stream
+        self._files: List[BinaryIO] = []  # closed last, e.g. the IPSW under a stream
+
+        table = self._read_at(OFFSET, SLOT_COUNT * SLOT_LENGTH)
+        self.images: List[ImageMetadata] = []
+        for image_index in range(SLOT_COUNT):
+            # 16 slots
+            image = parse_image_metadata(table[image_index * SLOT_LENGTH:(image_index + 1) * SLOT_LENGTH])
+            if image is not None:
+                self.images.append(image)
+        table.release()
+
+        self._images_by_type = {image.type: image for image in self.images}
+
+    @classmethod
+    def open(cls, path: Path, **kwargs) -> MseArchive:
+        stream = open(path, "rb")
+        try:
+            archive = cls.from_stream(stream, **kwargs)
+        except BaseException:
+            stream.close()
+            raise
+
+        if archive._stream is None:
+            stream.close()  # a memory map doesn't need its file
+        else:
+            archive._files.append(stream)
+        return archive
+
+    @classmethod
+    def from_stream(cls, stream: BinaryIO, *, cache_blocks: int = 16) -> MseArchive:
+        # an IPSW works too, cache_blocks bounds the memory spent on a deflated Firmware.MSE inside it
+        if is_zip(stream):
+            source, mapping = open_mse(stream, cache_blocks=cache_blocks)
+            if mapping is None:
+                return cls(stream=source)
+
+            # the slot views are slices of the member inside the mapped zip, the map is what has to be closed
+            archive = cls(source)
+            archive._mmap = mapping
+            return archive
+
+        return super().from_stream(stream)
+
+    @property
+    def zero_copy(self) -> bool:
+        """whether view() slices the buffer, otherwise every view is a fresh copy read from the stream"""
+        return self._buffer is not None
+
+    def _read_at(self, offset: int, length: int) -> memoryview:
+        if self._buffer is not None:
+            return self._buffer[offset:offset + length]
+
+        data = bytearray(length)
+        self._stream.seek(offset)
+        filled = 0
+        while filled < length:
+            read_length = self._stream.readinto(memoryview(data)[filled:])
+            if not read_length:
+                break
+            filled += read_length
+        return memoryview(data)[:filled]
+
+    def close(self):
+        # any view handed out must be released before this
+        if self._buffer is not None:
+            self._buffer.release()
+        if self._stream is not None:
+            self._stream.close()
+        super().close()
+        for file in self._files:
+            file.close()
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._images_by_type)
+
+    def __contains__(self, image_type: str) -> bool:
+        return image_type in self._images_by_type
+
+    def metadata(self, image_type: str) -> ImageMetadata:
+        return self._images_by_type[image_type]
+
+    def view(self, image_type: str) -> memoryview:
+        """the whole IMG1 of a slot"""
+        image = self._images_by_type[image_type]
+        return self._read_at(image.data_offset, image.data_length)
+
+    def reader(self, image_type: str) -> ViewReader:
+        """the IMG1 of a slot as a seekable read-only stream, for parsers that want one"""
+        return ViewReader(self.view(image_type))
+
+
+def detect_device(archive: MseArchive) -> Literal[6, 7]:
+    # n7g writes 0xFFFFFFFF to every load address
+    return 7 if all(image.load_address == 0xFFFFFFFF for image in archive.images) else 6
@@ -1,74 +1,83 @@
-from dataclasses import dataclass
-from typing import BinaryIO
+from typing import BinaryIO, Dict, List, Optional
 from pathlib import Path
-
-from ..utils import buffered_copy
-
-OFFSET = 0x5000
-
-
-@dataclass
-class ImageMetadata:
-    target: str  # "NAND", "NOR!", "flsh"
-    type: str  # "disk", "diag", "appl", "lbat", "bdsw", "chrg", "rsrc", "osos"
-
-    # id: int
-    dev_offset: int
-    length: int
-    address: int
-
-    entry_offset: int
-    # checksum: int
-    version: int
-    load_address: int
-
-
-def unpack_mse(stream: BinaryIO, directory: Path):
-    stream.seek(OFFSET)
-
-    images = []
-    for image_index in range(16):
-        # 16 slots
-        image_data = stream.read(40)
-        if image_data[0:4] == b"\x00\x00\x00\x00":
-            # placeholder
-            continue
-
-        pieces = [image_data[i:i+4] for i in range(0, 40, 4)]
-
-        image_target = pieces[0][::-1].decode("ascii")
-        image_type = pieces[1][::-1].decode("ascii")
-
-        image = ImageMetadata(
-            target=image_target,
-            type=image_type,
-            # id=int.from_bytes(pieces[2], "little"),
-            dev_offset=int.from_bytes(pieces[3], "little"),
-            length=int.from_bytes(pieces[4], "little"),
-            address=int.from_bytes(pieces[5], "little"),
-            entry_offset=int.from_bytes(pieces[6], "little"),
-            # checksum=int.from_bytes(pieces[7], "little"),
-            version=int.from_bytes(pieces[8], "little"),
-            load_address=int.from_bytes(pieces[9], "little"),
-        )
-
-        images.append(image)
-
-    print(images)
-
-    for image in images:
-        print(f"extracting {image}")
-
-        stream.seek(image.dev_offset + 0x1000)  # 4096 padding? unclear.
-        read_length = image.length + 0x800  # length does not include the 0x800 img1 header overhead
-
-        with open(directory / f"{image.type}.img1", "wb") as image_stream:
-            if image.length > 0x1000000:
-                # for files larger than 16 MB use chunked copying
-                buffered_copy(
-                    source=stream,
-                    destination=image_stream,
-                    limit=read_length
-                )
-            else:
-                image_stream.write(stream.read(read_length))
+import logging
+
+from .reader import MseArchive, ImageMetadata
+from ..digests import (
+    load_digests, save_digests, sha256, write_output, write_outputs, digest_files, verify_outputs
+)
+from ..instrument import Instrument, instrument_or_null
+
+logger = logging.getLogger(__name__)
+
+
+def _outputs(archive: MseArchive) -> Dict[str, memoryview]:
+    return {f"{image.type}.img1": archive.view(image.type) for image in archive.images}
+
+
+def _in_file_order(archive: MseArchive) -> List[ImageMetadata]:
+    # a stream behind the archive only ever has to go forward then
+    return sorted(archive.images, key=lambda image: image.data_offset)
+
+
+def unpack_mse(
+    stream: BinaryIO,
+    directory: Path,
+    *,
+    workers: Optional[int] = None,
+    instrument: Optional[Instrument] = None
+):
+    # IMG1s that are already there from an earlier unpack of the same data are left alone, see digests.py.
+    # stream can be an IPSW as well as an MSE
+    with MseArchive.from_stream(stream) as archive:
+        logger.debug("%s", archive.images)
+
+        if archive.zero_copy:
+            outputs = _outputs(archive)
+            write_outputs(directory, outputs, workers=workers, instrument=instrument)
+
+            for view in outputs.values():
+                view.release()
+            return
+
+        # every view is a copy here, one slot at a time keeps memory down to the biggest IMG1
+        instrument = instrument_or_null(instrument)
+        manifest = load_digests(directory)
+        entries = []
+        with instrument.timed("extract") as stage:
+            images = _in_file_order(archive)
+            for done, image in enumerate(images, start=1):
+                name = f"{image.type}.img1"
+                data = archive.view(image.type)
+
+                entry, written = write_output(directory, name, data, sha256(data), manifest.get(name), instrument, "extract")
+                entries.append(entry)
+                if written:
+                    stage.length += len(data)
+
+                data.release()
+                instrument.progress("extract", done, len(images))
+
+        save_digests(directory, entries)
+
+
+def verify_mse(stream: BinaryIO, directory: Path, *, workers: Optional[int] = None) -> List[str]:
+    """types of the slots whose IMG1 in directory is missing or differs from the one in the MSE (or IPSW)"""
+    with MseArchive.from_stream(stream) as archive:
+        if archive.zero_copy:
+            outputs = _outputs(archive)
+            differing = verify_outputs(directory, outputs, workers=workers)
+
+            for view in outputs.values():
+                view.release()
+            return [Path(name).stem for name in differing]
+
+        actual = digest_files({image.type: directory / f"{image.type}.img1" for image in archive.images}, workers=workers)
+        differing = []
+        for image in _in_file_order(archive):
+            data = archive.view(image.type)
+            if sha256(data) != actual[image.type]:
+                differing.append(image.type)
+            data.release()
+
+    return differing
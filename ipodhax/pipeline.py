@@ -0,0 +1,95 @@
+from __future__ import annotations
+from typing import BinaryIO, Dict, Literal, Optional
+from pathlib import Path
+import io
+
+from .mse import MseArchive
+from .mse.reader import detect_device
+from .mse.pack import write_mse
+from .img1 import Img1
+from .instrument import Instrument
+from .silverdb import SilverDB, unpack_silverdb
+from .silverdb.pack import encode_image_data, write_silverdb
+from .utils import ViewReader
+
+
+def unpack_resources(
+    mse_path: Path,
+    directory: Path,
+    *,
+    image_type: str = "rsrc",
+    raw: bool = False,
+    previews: bool = False,
+    instrument: Optional[Instrument] = None
+):
+    """Firmware.MSE straight to the SilverDB in one of its slots, without writing the IMG1 or its body anywhere."""
+    with MseArchive.open(mse_path) as archive:
+        with Img1.parse(archive.view(image_type)) as image:
+            with ViewReader(image.body) as body_stream:
+                unpack_silverdb(body_stream, directory, raw=raw, previews=previews, instrument=instrument)
+
+
+def _rebuild_silverdb(body: memoryview, replacements: Dict[int, Path], image_type: str) -> memoryview:
+    body_stream = io.BytesIO()
+
+    with SilverDB(body) as database:
+        missing = set(replacements) - set(database)
+        if len(missing) > 0:
+            raise ValueError(f"not in {image_type}: {sorted(missing)}")
+
+        entries = []
+        for image_id in sorted(database):
+            if image_id in replacements:
+                header = database.header(image_id)
+                if header is None:
+                    raise ValueError(f"{image_id} is empty, there is no format to encode it as")
+
+                data = encode_image_data(
+                    image_id=image_id,
+                    image_format=header.image_format,
+                    path=replacements[image_id]
+                )
+            else:
+                data = database.raw(image_id)
+                if len(data) == 0:
+                    data = None
+
+            entries.append((image_id, data))
+
+        write_silverdb(body_stream, entries)
+        # the views have to go before the database closes
+        entries.clear()
+        data = None
+
+    return body_stream.getbuffer()
+
+
+def replace_resources(
+    mse_path: Path,
+    stream: BinaryIO,
+    replacements: Dict[int, Path],
+    *,
+    image_type: str = "rsrc",
+    device: Optional[Literal[6, 7]] = None,
+    instrument: Optional[Instrument] = None
+):
+    """
+    rebuilds the SilverDB in one slot with some images replaced by PNGs, then the IMG1 around it and the MSE around that.
+    replaced images keep their original format, everything else is copied through untouched.
+    """
+    with MseArchive.open(mse_path) as archive:
+        if device is None:
+            device = detect_device(archive)
+
+        img1_stream = io.BytesIO()
+        with Img1.parse(archive.view(image_type)) as image:
+            image.body = _rebuild_silverdb(image.body, replacements, image_type)
+            image.write(img1_stream)
+
+        images = {slot_type: archive.view(slot_type) for slot_type in archive}
+        images[image_type] = img1_stream.getbuffer()
+        write_mse(stream, images, device=device, instrument=instrument)
+
+        for view in images.values():
+            view.release()
+
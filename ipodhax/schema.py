@@ -0,0 +1,181 @@
+"""
+fixed layout records, each declared once as a Schema. a schema compiles to one struct.Struct, so a record is a
+single unpack and a whole table of them a single iter_unpack over one read, packing goes through the same struct.
+
+values come and go as tuples in declaration order, padding left out. the records built from them
+(ImageMetadata, Img1Header, FileReference, ImageHeader) keep their fields in that same order, so Record(*values).
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+import struct
+
+
+class Field(NamedTuple):
+    name: Optional[str]  # None for padding, skipped when unpacking and zeroed when packing
+    format: str  # struct format of this field alone, without byte order
+    decode: Optional[Callable[[Any], Any]] = None
+    encode: Optional[Callable[[Any], Any]] = None
+
+
+def u8(name: str) -> Field:
+    return Field(name, "B")
+
+
+def u16(name: str) -> Field:
+    return Field(name, "H")
+
+
+def u32(name: str) -> Field:
+    return Field(name, "I")
+
+
+def wide(name: str, length: int) -> Field:
+    # integers wider than struct knows about, e.g. the 32 byte IMG1 salt
+    return Field(
+        name, f"{length}s",
+        decode=lambda value: int.from_bytes(value, "little"),
+        encode=lambda value: int.to_bytes(value, length, "little")
+    )
+
+
+def raw(name: str, length: int) -> Field:
+    return Field(name, f"{length}s")
+
+
+def text(name: str, length: int) -> Field:
+    return Field(name, f"{length}s", decode=lambda value: value.decode("ascii"), encode=lambda value: value.encode("ascii"))
+
+
+def fourcc(name: str) -> Field:
+    # stored as a little endian integer, so "NAND" is b"DNAN" on disk
+    return Field(
+        name, "4s",
+        decode=lambda value: value[::-1].decode("ascii"),
+        encode=lambda value: value.encode("ascii")[::-1]
+    )
+
+
+def padding(length: int) -> Field:
+    return Field(None, f"{length}x")
+
+
+class Schema:
+    def __init__(self, *fields: Field):
+        self.struct = struct.Struct("<" + "".join(field.format for field in fields))
+        self.size = self.struct.size
+
+        self.fields = tuple(field for field in fields if field.name is not None)
+        self.names = tuple(field.name for field in self.fields)
+        self._decoders = tuple((index, field.decode) for index, field in enumerate(self.fields) if field.decode)
+        self._encoders = tuple((index, field.encode) for index, field in enumerate(self.fields) if field.encode)
+
+        self._offsets: Dict[str, Tuple[int, struct.Struct]] = {}
+        offset = 0
+        for field in fields:
+            field_struct = struct.Struct("<" + field.format)
+            if field.name is not None:
+                self._offsets[field.name] = (offset, field_struct)
+            offset += field_struct.size
+
+    def _decode(self, values: tuple) -> tuple:
+        if not self._decoders:
+            return values
+        values = list(values)
+        for index, decode in self._decoders:
+            values[index] = decode(values[index])
+        return tuple(values)
+
+    def _encode(self, values: tuple) -> tuple:
+        if len(values) != len(self.fields):
+            raise ValueError(f"expected {len(self.fields)} values, got {len(values)}")
+        if not self._encoders:
+            return values
+        values = list(values)
+        for index, encode in self._encoders:
+            values[index] = encode(values[index])
+        return tuple(values)
+
+    def unpack(self, buffer, offset: int = 0) -> tuple:
+        if len(buffer) - offset < self.size:
+            raise ValueError(f"truncated record: {len(buffer) - offset} of {self.size} bytes")
+        return self._decode(self.struct.unpack_from(buffer, offset))
+
+    def iter_unpack(self, buffer) -> Iterator[tuple]:
+        if len(buffer) % self.size != 0:
+            raise ValueError(f"truncated table: {len(buffer)} bytes is not a whole number of {self.size} byte records")
+        if not self._decoders:
+            return self.struct.iter_unpack(buffer)
+        return map(self._decode, self.struct.iter_unpack(buffer))
+
+    def pack(self, *values) -> bytes:
+        return self.struct.pack(*self._encode(values))
+
+    def pack_into(self, buffer, offset: int, *values):
+        self.struct.pack_into(buffer, offset, *self._encode(values))
+
+    def offset(self, name: str) -> int:
+        return self._offsets[name][0]
+
+    def pack_field(self, name: str, value) -> bytes:
+        # one field on its own, for rewriting it in place at offset(name)
+        field = self.fields[self.names.index(name)]
+        return self._offsets[name][1].pack(value if field.encode is None else field.encode(value))
+
+
+MSE_SLOT = Schema(
+    fourcc("target"),  # "NAND", "NOR!", "flsh"
+    fourcc("type"),
+    padding(4),  # id
+    u32("dev_offset"),
+    u32("length"),
+    u32("address"),
+    u32("entry_offset"),
+    padding(4),  # checksum, never checked
+    u32("version"),
+    u32("load_address"),
+)
+
+IMG1_HEADER = Schema(
+    text("magic", 4),
+    text("version", 3),
+    u8("signature_format"),
+    u32("entry_point"),
+    u32("body_length"),
+    u32("data_length"),
+    u32("footer_offset"),
+    u32("footer_length"),
+    wide("salt", 32),
+    u16("unk0"),
+    u16("unk1"),
+    wide("header_signature", 16),
+    u32("header_leftover"),
+)
+
+SILVERDB_HEADER = Schema(
+    raw("magic", 4),
+    u32("code_page"),
+    u32("table_type"),  # 1 for image, 2 (or 3?) for language
+    text("table_type_str", 4),  # paMB for image, mTDL for language
+    u32("file_count"),
+    u32("unk0"),
+    u32("unk1"),
+)
+
+FILE_REFERENCE = Schema(
+    u32("id"),
+    u32("offset"),
+    u32("size"),
+)
+
+IMAGE_HEADER = Schema(
+    u16("image_format"),
+    u16("unk0"),
+    u16("row_length"),
+    u16("flags"),
+    u32("unk1"),
+    u32("unk2"),
+    u32("height"),
+    u32("width"),
+    u32("id"),
+    u32("size"),
+)
@@ -1,2 +1,4 @@
 from .pack import pack_silverdb
-from .unpack import unpack_silverdb
+from .unpack import unpack_silverdb, iter_silverdb
+from .reader import SilverDB
+from .language import LanguageDB
@@ -0,0 +1,203 @@
+from __future__ import annotations
+from typing import BinaryIO, Iterator, TextIO, Tuple
+from pathlib import Path
+import tempfile
+import array
+import json
+import os
+import re
+
+import numpy as np
+
+from .reader import Buffer, SilverDBFile
+from .unpack import SILVERDB_MAGIC
+from ..schema import FILE_REFERENCE, SILVERDB_HEADER
+from ..utils import buffered_copy
+
+STRING_TABLE_ID = 1400140320  # "Str " as a fourcc, apparently always the only file
+HEAD_NAME = "head.json"
+STRINGS_NAME = "strings.tsv"
+
+# nothing documents the inside of a string table entry, this is the layout we assume:
+#   u32 string count
+#   u32 offset of each string, relative to the start of the entry
+#   the strings, each terminated by a null character in the encoding given to LanguageDB
+# a string id is its position in the offset index.
+# none of this has been checked against a real firmware, so unpack_silverdb only goes here when asked to.
+
+# the header has nothing trustworthy to say about the text encoding: the word after the magic is what pack_silverdb
+# fills with ref_end_offset, so it has to be given instead
+DEFAULT_ENCODING = "utf-8"
+
+_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+_UNESCAPES = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r"}
+_UNESCAPE_PATTERN = re.compile(r"\\(.)")
+
+
+def _terminator(encoding: str) -> bytes:
+    return "\0".encode(encoding)
+
+
+def _strip_terminator(data: bytes, terminator: bytes) -> bytes:
+    # the terminator has to sit on a character boundary, which matters for utf-16
+    index = data.find(terminator)
+    while index != -1 and index % len(terminator) != 0:
+        index = data.find(terminator, index + 1)
+
+    return data if index == -1 else data[:index]
+
+
+class StringTable:
+    """one string table entry, strings are only decoded when looked up"""
+
+    def __init__(self, buffer: memoryview, encoding: str):
+        self._buffer = buffer
+        self.encoding = encoding
+        self._terminator = _terminator(encoding)
+
+        if len(buffer) < 4:
+            raise ValueError(f"string table of {len(buffer)} bytes has no count, not the assumed layout")
+        count = int.from_bytes(buffer[0:4], "little")
+        if 4 + count * 4 > len(buffer):
+            raise ValueError(f"string table index of {count} strings runs past the {len(buffer)} byte entry, not the assumed layout")
+        self._offsets = np.frombuffer(buffer, dtype="<u4", count=count, offset=4)  # the index, not copied
+        if count > 0 and int(self._offsets.max()) > len(buffer):
+            raise ValueError(f"string offset past the {len(buffer)} byte entry, not the assumed layout")
+        # a string ends at most where the next one starts
+        self._ends = np.append(np.unique(self._offsets), len(buffer))
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self._offsets)))
+
+    def __getitem__(self, string_id: int) -> str:
+        start = int(self._offsets[string_id])
+        end = int(self._ends[np.searchsorted(self._ends, start, side="right")])
+        return _strip_terminator(bytes(self._buffer[start:end]), self._terminator).decode(self.encoding)
+
+    def items(self) -> Iterator[Tuple[int, str]]:
+        for string_id in range(len(self._offsets)):
+            yield string_id, self[string_id]
+
+
+class LanguageDB(SilverDBFile):
+    """random access to the string tables of an mTDL SilverDB"""
+    TABLE_TYPE = "mTDL"
+
+    def __init__(self, buffer: Buffer, *, encoding: str = DEFAULT_ENCODING):
+        super().__init__(buffer)
+        self.encoding = encoding
+
+    def table(self, table_id: int = STRING_TABLE_ID) -> StringTable:
+        # the table keeps a view into the buffer, drop it before close()
+        return StringTable(self.raw(table_id), self.encoding)
+
+    def string(self, string_id: int, table_id: int = STRING_TABLE_ID) -> str:
+        return self.table(table_id)[string_id]
+
+
+def export_strings(database: LanguageDB, stream: TextIO):
+    # one "table_id<tab>string_id<tab>text" line per string, escaped so every string stays on its line
+    for table_id in database:
+        for string_id, text in database.table(table_id).items():
+            stream.write(f"{table_id}\t{string_id}\t{text.translate(_ESCAPES)}\n")
+
+
+def _table_index(offsets: array.array) -> bytes:
+    # the count and the offsets, which are relative to the strings until the index in front of them is counted in
+    index_length = 4 + len(offsets) * 4
+    return int.to_bytes(len(offsets), 4, "little") + (np.frombuffer(offsets, dtype=np.uint32) + index_length).astype("<u4").tobytes()
+
+
+def import_strings(stream: TextIO, strings: BinaryIO, encoding: str) -> Iterator[Tuple[int, array.array, int]]:
+    """
+    reads lines grouped by table with ids in order, like export_strings writes them. the encoded strings go straight
+    to strings one table after the other, only their offsets are kept. yields (table_id, offsets, strings length) per table.
+    """
+    terminator = _terminator(encoding)
+    table_id = None
+    offsets = array.array("I")
+    length = 0
+
+    for line_number, line in enumerate(stream, start=1):
+        line = line.rstrip("\n")
+        if not line:
+            continue
+
+        line_table_id, string_id, text = line.split("\t", 2)
+        line_table_id = int(line_table_id)
+
+        if line_table_id != table_id:
+            if table_id is not None:
+                yield table_id, offsets, length
+            table_id = line_table_id
+            offsets = array.array("I")
+            length = 0
+
+        if int(string_id) != len(offsets):
+            raise ValueError(f"line {line_number}: expected string id {len(offsets)}, got {string_id}")
+
+        offsets.append(length)
+        data = _UNESCAPE_PATTERN.sub(lambda match: _UNESCAPES[match.group(1)], text).encode(encoding) + terminator
+        strings.write(data)
+        length += len(data)
+
+    if table_id is not None:
+        yield table_id, offsets, length
+
+
+def unpack_language(database: LanguageDB, directory: Path):
+    # strings.tsv is written under a temporary name and only moved into place once every table decoded,
+    # a table that doesn't fit the assumed layout leaves no files
+    path = directory / STRINGS_NAME
+    temp_path = path.with_name(f".{STRINGS_NAME}.tmp")
+    try:
+        with open(temp_path, "w", encoding="utf-8", newline="\n") as strings_stream:
+            export_strings(database, strings_stream)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    os.replace(temp_path, path)
+
+    with open(directory / HEAD_NAME, "w", encoding="utf-8") as head_stream:
+        json.dump({
+            "table_type_str": database.table_type_str,
+            "table_type": database.table_type,
+            "unk0": database.unk0,
+            "unk1": database.unk1,
+            "encoding": database.encoding
+        }, fp=head_stream, indent=2)
+
+
+def pack_language(stream: BinaryIO, directory: Path):
+    with open(directory / HEAD_NAME, "r", encoding="utf-8") as head_stream:
+        header_data = json.load(head_stream)
+
+    # the reference table needs every table's length up front, so the encoded strings wait in a temporary file
+    # and only the offsets are held in memory
+    with open(directory / STRINGS_NAME, "r", encoding="utf-8", newline="\n") as strings_stream, \
+            tempfile.TemporaryFile() as encoded:
+        tables = list(import_strings(strings_stream, encoded, header_data["encoding"]))
+
+        # same as pack_silverdb, the word after the magic is where the entries start
+        ref_end_offset = SILVERDB_HEADER.size + len(tables) * FILE_REFERENCE.size
+        header = bytearray(SILVERDB_HEADER.pack(
+            SILVERDB_MAGIC, ref_end_offset, header_data["table_type"], header_data["table_type_str"],
+            len(tables), header_data["unk0"], header_data["unk1"]
+        ))
+
+        offset = 0
+        for table_id, offsets, strings_length in tables:
+            length = 4 + len(offsets) * 4 + strings_length
+            header.extend(FILE_REFERENCE.pack(table_id, offset, length))
+            offset += length + (length % 2)  # pad to 2
+
+        stream.write(header)
+        encoded.seek(0)
+        for table_id, offsets, strings_length in tables:
+            stream.write(_table_index(offsets))
+            buffered_copy(encoded, stream, limit=strings_length)
+            if strings_length % 2 != 0:
+                stream.write(b"\x00")  # pad to 2, the index is always a whole number of words
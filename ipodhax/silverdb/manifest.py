@@ -0,0 +1,82 @@
+from __future__ import annotations
+from typing import Dict, Iterable
+from dataclasses import dataclass, asdict
+from pathlib import Path
+import hashlib
+import logging
+import json
+import os
+
+MANIFEST_NAME = "manifest.json"  # no underscore, so pack_silverdb's glob never picks it up
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ManifestEntry:
+    id: int
+    source: str  # file name inside the unpacked directory
+    source_mtime: int  # in nanoseconds
+    source_size: int
+    source_hash: str
+    blob_hash: str  # whole entry, image header included
+    offset: int  # relative to the end of the reference table, like FileReference
+    size: int
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_entry(image_id: int, path: Path, source_hash: str, blob_hash: str, offset: int, size: int) -> ManifestEntry:
+    stat = path.stat()
+    return ManifestEntry(
+        id=image_id,
+        source=path.name,
+        source_mtime=stat.st_mtime_ns,
+        source_size=stat.st_size,
+        source_hash=source_hash,
+        blob_hash=blob_hash,
+        offset=offset,
+        size=size
+    )
+
+
+def source_unchanged(entry: ManifestEntry, path: Path) -> bool:
+    if entry.source != path.name:
+        return False
+
+    stat = path.stat()
+    if stat.st_size != entry.source_size:
+        return False
+    if stat.st_mtime_ns == entry.source_mtime:
+        return True
+
+    # touched but maybe not modified
+    return digest(path.read_bytes()) == entry.source_hash
+
+
+def load_manifest(path: Path) -> Dict[int, ManifestEntry]:
+    """the manifest at path, usually directory / MANIFEST_NAME. empty if there is none"""
+    if not path.exists():
+        return {}
+
+    try:
+        with open(path, "r", encoding="utf-8") as manifest_stream:
+            data = json.load(manifest_stream)
+        return {entry["id"]: ManifestEntry(**entry) for entry in data["images"]}
+    except (ValueError, KeyError, TypeError):
+        # nothing gets reused then, pack encodes everything and writes a new one
+        logger.warning("ignoring %s, it is not a SilverDB manifest", path)
+        return {}
+
+
+def save_manifest(path: Path, entries: Iterable[ManifestEntry]):
+    temp_path = path.with_name(f".{path.name}.tmp")
+
+    with open(temp_path, "w", encoding="utf-8") as manifest_stream:
+        json.dump({
+            "images": [asdict(entry) for entry in sorted(entries, key=lambda entry: entry.id)]
+        }, fp=manifest_stream, indent=2)
+
+    os.replace(temp_path, path)
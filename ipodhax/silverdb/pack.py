@@ -1,185 +1,390 @@
 from __future__ import annotations
-from typing import BinaryIO
+from typing import BinaryIO, Dict, List, Literal, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
+import contextlib
+import logging
 import math
+import time
 
 from PIL import Image
+import numpy as np
 
-from ..utils import pixel_toBGRA, pixel_to565
+from .language import STRINGS_NAME, pack_language
+from .manifest import MANIFEST_NAME, ManifestEntry, digest, load_manifest, make_entry, save_manifest, source_unchanged
+from .reader import SilverDB
+from .unpack import FileReference, IMAGE_HEADER_LENGTH, SILVERDB_MAGIC, parse_image_header
+from .pixels import PIXEL_TO565_R, PIXEL_TO565_G, PIXEL_TO565_B
+from ..instrument import Instrument, instrument_or_null
+from ..schema import FILE_REFERENCE, IMAGE_HEADER, SILVERDB_HEADER
 
 ROOT_PATH = Path(__file__).parent
 
-
-def encode_image(image_id: int, image_format: int, path: Path, stream: BinaryIO):
+logger = logging.getLogger(__name__)
+
+
+def _color_keys(colors: np.ndarray) -> np.ndarray:
+    # one uint32 per RGBA color so colors can be compared as scalars
+    return np.ascontiguousarray(colors, dtype=np.uint8).view("<u4")[..., 0]
+
+
+def _build_palette(
+    image: Image.Image,
+    *,
+    order: Literal["sorted", "first"] = "sorted",
+    palette: Optional[np.ndarray] = None
+) -> tuple[np.ndarray, np.ndarray]:
+    pixels = _color_keys(np.asarray(image))
+    colors, first_seen, indices = np.unique(pixels, return_index=True, return_inverse=True)
+    indices = indices.reshape(pixels.shape)
+
+    if palette is not None and len(palette) > 0:
+        # keep the original palette if every color is still in it, so rebuilds don't reshuffle indices
+        palette_keys = _color_keys(palette)
+        palette_order = np.argsort(palette_keys, kind="stable")  # duplicates resolve to the first entry
+        positions = np.searchsorted(palette_keys[palette_order], colors)
+        positions = np.minimum(positions, len(palette_keys) - 1)
+
+        if np.array_equal(palette_keys[palette_order][positions], colors):
+            return palette, palette_order[positions][indices]
+
+    if order == "sorted":
+        return colors.view(np.uint8).reshape(-1, 4), indices
+    elif order == "first":
+        color_order = np.argsort(first_seen)
+        rank = np.empty_like(color_order)
+        rank[color_order] = np.arange(len(color_order))
+        return colors[color_order].view(np.uint8).reshape(-1, 4), rank[indices]
+    else:
+        raise ValueError(f"unknown palette order {order}")
+
+
+def encode_image_data(
+    image_id: int,
+    image_format: int,
+    path: Path,
+    *,
+    palette_order: Literal["sorted", "first"] = "sorted",
+    palette: Optional[np.ndarray] = None
+) -> bytes:
+    # palette is an RGBA array of an earlier encoding of this image, reused when it still fits
     image: Image.Image
 
     with Image.open(path) as image:
-        start_offset = stream.tell()
-
-        stream.write(int.to_bytes(image_format, 2, "little"))
-        stream.write(int.to_bytes(1, 2, "little"))  # unk0
-
         if image_format == 0x1888:
             # keep RGBA
+            image = image.convert("RGBA")
             flags = 0x0020
             row_length = image.size[0] * 4
+            data = np.asarray(image)[:, :, [2, 1, 0, 3]].tobytes()
         elif image_format == 0x0004:
             image = image.convert("L")
             flags = 0x0004
-            row_length = math.ceil(image.size[0] / 2)  # will be used later
+            row_length = math.ceil(image.size[0] / 2)
+
+            pixels = np.zeros((image.size[1], row_length * 2), dtype=np.uint8)
+            pixels[:, :image.size[0]] = np.asarray(image) // 17  # odd rows are padded with 0
+            data = ((pixels[:, 0::2] << 4) | pixels[:, 1::2]).tobytes()
         elif image_format == 0x0008:
             image = image.convert("L")
             flags = 0x0008
             row_length = image.size[0]
+            data = np.asarray(image).tobytes()
         elif image_format == 0x0565:
             image = image.convert("RGB")
             flags = 0x0010
             row_length = image.size[0] * 2
-        elif image_format == 0x0064:
-            # keep RGBA
-            flags = 0x0008
-            row_length = image.size[0]
-        elif image_format == 0x0065:
+
+            pixels = np.asarray(image)
+            data = (
+                (PIXEL_TO565_R[pixels[:, :, 0]] << 11) |
+                (PIXEL_TO565_G[pixels[:, :, 1]] << 5) |
+                PIXEL_TO565_B[pixels[:, :, 2]]
+            ).astype("<u2").tobytes()
+        elif image_format in {0x0064, 0x0065}:
             # keep RGBA
-            flags = 0x0010
-            row_length = image.size[0] * 2
+            image = image.convert("RGBA")
+            palette, indices = _build_palette(image, order=palette_order, palette=palette)
+
+            if image_format == 0x0064:
+                if len(palette) > 0xFF:
+                    raise ValueError(f"more than 255 colors in {image_id}")
+                flags = 0x0008
+                row_length = image.size[0]
+                index_type = np.uint8
+            else:
+                if len(palette) > 0xFFFF:
+                    raise ValueError(f"more than 65535 colors in {image_id}")
+                flags = 0x0010
+                row_length = image.size[0] * 2
+                index_type = "<u2"
+
+            data = b"".join((
+                int.to_bytes(len(palette), 4, "little"),
+                palette[:, [2, 1, 0, 3]].tobytes(),
+                indices.astype(index_type).tobytes()
+            ))
         else:
             raise ValueError(f"cannot pack unknown format {image_format:04x}")
 
-        stream.write(int.to_bytes(row_length, 2, "little"))
-        stream.write(int.to_bytes(flags, 2, "little"))
-        stream.write(bytes(4))  # unk1
-        stream.write(bytes(4))  # unk2
-        stream.write(int.to_bytes(image.size[1], 4, "little"))
-        stream.write(int.to_bytes(image.size[0], 4, "little"))
-        stream.write(int.to_bytes(image_id, 4, "little"))
-        length_offset = stream.tell()  # hack: come back here to write length
-        stream.write(bytes(4))
-        # 32 bytes written
-
-        # header_end_offset = stream.tell()
-        if image_format == 0x1888:
-            for pixel in image.getdata():
-                stream.write(pixel_toBGRA(pixel))
-        elif image_format == 0x0004:
-            width = image.size[0]
-            height = image.size[1]
+        header = bytearray(IMAGE_HEADER.pack(
+            image_format, 1, row_length, flags, 0, 0, image.size[1], image.size[0], image_id, len(data)
+        ))  # unk0 is always 1, unk1 and unk2 0. size leaves out these 32 bytes
 
-            pixels = list(image.getdata())
+        header.extend(data)
 
-            array = bytearray()
+    return bytes(header)
 
-            for y in range(height):
-                row = pixels[(y * width):((y * width) + width)]
 
-                if len(row) % 2 != 0:
-                    row.append(0)
+def encode_image(image_id: int, image_format: int, path: Path, stream: BinaryIO):
+    start_offset = stream.tell()
+    data = encode_image_data(image_id=image_id, image_format=image_format, path=path)
+    stream.write(data)
+
+    return start_offset, len(data)
+
+
+def read_raw_record(image_id: int, path: Path) -> bytes:
+    # a raw record is an entry exactly as stored, as written by unpack_silverdb(raw=True)
+    data = path.read_bytes()
+    header = parse_image_header(data[:IMAGE_HEADER_LENGTH])
+
+    if header.id != image_id:
+        raise ValueError(f"id does not match in {path.name}: {header.id}")
+    if header.size + IMAGE_HEADER_LENGTH != len(data):
+        raise ValueError(f"size does not match in {path.name}: {header.size}")
+
+    return data
+
+
+def _encode_item(
+    item: Tuple[int, Optional[int], Path],
+    palette: Optional[np.ndarray],
+    palette_order: Literal["sorted", "first"]
+) -> Tuple[Optional[bytes], float]:
+    # timed here because with a pool this runs in a worker process
+    image_id, image_format, path = item
+    if not image_format:
+        return None, 0.0
+
+    start = time.perf_counter()
+    data = encode_image_data(
+        image_id=image_id,
+        image_format=image_format,
+        path=path,
+        palette_order=palette_order,
+        palette=palette
+    )
+    return data, time.perf_counter() - start
+
+
+def _reuse_blobs(items: List[Tuple[int, Optional[int], Path]], manifest: Dict[int, ManifestEntry], database: SilverDB):
+    # copies entries whose source is unchanged since the last unpack or pack straight out of the reference database
+    blobs: Dict[int, bytes] = {}
+
+    for index, (image_id, image_format, path) in enumerate(items):
+        entry = manifest.get(image_id)
+        if not image_format or entry is None or image_id not in database:
+            continue
+        if not source_unchanged(entry, path):
+            continue
 
-                for x_idx in range(0, len(row), 2):
-                    i0, i1 = row[x_idx:x_idx+2]
-                    array.append(((i0 // 17) << 4) + (i1 // 17))
-            stream.write(array)
-        elif image_format == 0x0008:
-            stream.write(bytes(image.getdata()))
-        elif image_format == 0x0565:
-            for pixel in image.getdata():
-                stream.write(int.to_bytes(pixel_to565(pixel), 2, "little"))
-        elif image_format in {0x0064, 0x0065}:
-            pixels = image.getdata()
-            unique_pixels = list(set(pixels))
+        data = bytes(database.raw(image_id))
+        if len(data) == entry.size and digest(data) == entry.blob_hash:
+            blobs[index] = data
+
+    return blobs
 
-            if image_format == 0x0064:
-                if len(unique_pixels) > 0xFF:
-                    raise ValueError(f"more than 255 colors in {image_id}")
-            elif image_format == 0x0065:
-                if len(unique_pixels) > 0xFFFF:
-                    raise ValueError(f"more than 65535 colors in {image_id}")
 
-            stream.write(int.to_bytes(len(unique_pixels), 4, "little"))
+def _with_id(data: bytes, image_id: int) -> bytes:
+    # the same entry under another id, the header id is the only difference
+    start = IMAGE_HEADER.offset("id")
+    id_bytes = IMAGE_HEADER.pack_field("id", image_id)
+    return b"".join((data[:start], id_bytes, data[start + len(id_bytes):]))
 
-            for color in unique_pixels:
-                stream.write(pixel_toBGRA(color))
 
-            reverse_index = {color: n for n, color in enumerate(unique_pixels)}
+def write_silverdb(stream: BinaryIO, entries: List[Tuple[int, Optional[bytes]]]) -> List[FileReference]:
+    """
+    writes a whole image database in one forward pass from (id, entry) pairs in table order,
+    an entry of None is written as an empty file. returns the reference table as written.
+    """
+    ref_end_offset = 28 + len(entries) * (4 * 3)
 
-            for pixel in pixels:
-                stream.write(int.to_bytes(reverse_index[pixel], 1 if image_format == 0x0064 else 2, "little"))
+    references = []
+    offset = 0
+    for image_id, data in entries:
+        if data is None:
+            references.append(FileReference(id=image_id, offset=offset, size=0))  # wrongly pretend.
         else:
-            raise ValueError(f"unk format: 0x{image_format:04x}")
+            references.append(FileReference(id=image_id, offset=offset, size=len(data)))
+            offset += len(data) + (len(data) % 2)  # pad to 2
 
-        end_offset = stream.tell()
-        length = (end_offset - start_offset)
-        stream.seek(length_offset)
-        stream.write(int.to_bytes((length - 32), 4, "little"))  # smaller to account for head
-        stream.seek(end_offset)
+    header = bytearray(SILVERDB_HEADER.pack(SILVERDB_MAGIC, ref_end_offset, 1, "paMB", len(entries), 1, 28))
 
-    return start_offset, length
+    logger.debug("writing %d references, ref_end_offset=%d", len(references), ref_end_offset)
+    for reference in references:
+        header.extend(FILE_REFERENCE.pack(reference.id, reference.offset, reference.size))
 
+    stream.write(header)
 
-def pack_silverdb(stream: BinaryIO, directory: Path):
-    items = []
-    for path in directory.glob("*_*.*"):
-        if path.stem.startswith("."):
+    for (image_id, data), reference in zip(entries, references):
+        if data is None:
+            logger.debug("%d is empty", image_id)
             continue
 
-        image_id, image_format = path.stem.split("_")
+        stream.write(data)
+        if reference.size % 2 != 0:
+            stream.write(b"\x00")  # pad to 2
 
-        items.append((
-            int(image_id),
-            None if image_format == "empty" else int(image_format, 16)
-        ))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "image_id=%d image_format=%04x offset=%d length=%d",
+                image_id, parse_image_header(data).image_format, ref_end_offset + reference.offset, reference.size
+            )
 
-    items.sort(key=lambda k: k[0])
+    return references
+
+
+def pack_silverdb(
+    stream: BinaryIO,
+    directory: Path,
+    *,
+    workers: Optional[int] = None,
+    reference: Optional[Path] = None,
+    reuse_palettes: bool = True,
+    palette_order: Literal["sorted", "first"] = "sorted",
+    dedup: bool = False,
+    language: bool = False,
+    manifest_path: Optional[Path] = None,
+    write_manifest: bool = True,
+    instrument: Optional[Instrument] = None
+):
+    # dedup encodes identical sources once. every entry still gets its own copy, the header id has to match
+    # the reference so entries can't share a blob, only the id is patched into the copies.
+    # off by default, finding duplicates means reading and hashing every PNG before anything is encoded.
+    # language packs a directory unpacked from an mTDL database, opt-in like unpacking one since the layout is a guess.
+    # the manifest that reference is matched against, and that is written for the next pack, is manifest_path, by
+    # default manifest.json in directory. write_manifest=False leaves directory untouched
+    instrument = instrument_or_null(instrument)
+
+    if (directory / STRINGS_NAME).exists():
+        # unpacked from an mTDL database
+        if not language:
+            raise ValueError(f"{directory} holds an mTDL language database, its layout is unverified, pass language=True to pack it")
+        pack_language(stream, directory)
+        return
+
+    items_by_id = {}
+    for path in directory.glob("*_*.*"):
+        if path.stem.startswith("."):
+            continue
 
-    stream.write(b"\x03\x00\x00\x00")
+        image_id, image_format = path.stem.split("_")
+        image_id = int(image_id)
 
-    ref_end_offset_offset = stream.tell()
-    stream.write(bytes(4))
+        existing = items_by_id.get(image_id)
+        if existing is not None and existing[1] is not None and existing[2].suffix == ".bin":
+            # raw records win over PNGs, which are only previews then
+            continue
 
-    stream.write(int.to_bytes(1, 4, "little"))
-    stream.write(b"paMB")
-    stream.write(int.to_bytes(len(items), 4, "little"))
-    stream.write(int.to_bytes(1, 4, "little"))
-    stream.write(int.to_bytes(28, 4, "little"))
+        items_by_id[image_id] = (
+            image_id,
+            None if image_format == "empty" else int(image_format, 16),
+            path
+        )
+
+    items = sorted(items_by_id.values(), key=lambda k: k[0])
+
+    if manifest_path is None:
+        manifest_path = directory / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    blobs: List[Optional[bytes]] = [None] * len(items)
+    palettes: List[Optional[np.ndarray]] = [None] * len(items)
+    source_hashes = {}
+
+    if reference is not None:
+        with SilverDB.open(reference) as database:
+            for index, data in _reuse_blobs(items, manifest, database).items():
+                blobs[index] = data
+                source_hashes[index] = manifest[items[index][0]].source_hash
+
+            if reuse_palettes:
+                for index, (image_id, image_format, path) in enumerate(items):
+                    if image_format in {0x0064, 0x0065} and blobs[index] is None and image_id in database:
+                        palettes[index] = database.palette(image_id)
+    reused = len(source_hashes)
+
+    for index, (image_id, image_format, path) in enumerate(items):
+        if image_format and blobs[index] is None and path.suffix == ".bin":
+            # no pixel work at all, copy the record through
+            blobs[index] = read_raw_record(image_id, path)
+            source_hashes[index] = digest(blobs[index])
+
+    copied = len(source_hashes) - reused
+    pending = [index for index, (image_id, image_format, path) in enumerate(items) if image_format and blobs[index] is None]
+
+    duplicates: Dict[int, int] = {}  # index of a duplicate -> index of the entry encoded for it
+    if dedup:
+        first_by_key: Dict[Tuple[int, str, Optional[str]], int] = {}
+        for index in pending:
+            source_hashes[index] = digest(items[index][2].read_bytes())
+            palette = palettes[index]
+            key = (items[index][1], source_hashes[index], None if palette is None else digest(palette.tobytes()))
+            duplicates[index] = first_by_key.setdefault(key, index)
+        duplicates = {index: first for index, first in duplicates.items() if index != first}
+        pending = [index for index in pending if index not in duplicates]
+
+    logger.info("reusing %d images, copying %d raw, encoding %d, %d duplicates", reused, copied, len(pending), len(duplicates))
+
+    # phase 1: encode everything up front, images don't depend on each other
+    with instrument.timed("encode") as stage, contextlib.ExitStack() as stack:
+        if workers and workers > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            encoded = executor.map(
+                _encode_item,
+                [items[index] for index in pending],
+                [palettes[index] for index in pending],
+                repeat(palette_order),
+                chunksize=max(1, len(pending) // (workers * 4))
+            )
+        else:
+            encoded = (_encode_item(items[index], palettes[index], palette_order) for index in pending)
 
-    file_info_offset = stream.tell()  # seek back here
-    stream.write(bytes(len(items) * (4 * 3)))
+        for done, (index, (data, seconds)) in enumerate(zip(pending, encoded), start=1):
+            blobs[index] = data
+            if index not in source_hashes:
+                source_hashes[index] = digest(items[index][2].read_bytes())
 
-    ref_end_offset = stream.tell()
-    stream.seek(ref_end_offset_offset)
-    stream.write(int.to_bytes(ref_end_offset, 4, "little"))
-    stream.seek(ref_end_offset)
+            instrument.image("encode", items[index][0], seconds, len(data))
+            instrument.progress("encode", done, len(pending))
+            stage.length += len(data)
 
-    file_offset_lengths = []  # fill this with tuples!
+        for index, first in duplicates.items():
+            blobs[index] = _with_id(blobs[first], items[index][0])
 
-    print("writing image..")
-    for image_id, image_format in items:
-        if image_format:
-            path = directory / f"{image_id}_{image_format:04x}.png"
-            offset, length = encode_image(
-                image_id=image_id,
-                image_format=image_format,
-                path=path,
-                stream=stream
-            )
-            if length % 2 != 0:
-                stream.write(b"\x00")  # pad to 2
+    # phase 2: lengths are known now, so the whole database can be written front to back
+    with instrument.timed("write") as stage:
+        references = write_silverdb(stream, [(image_id, data) for (image_id, image_format, path), data in zip(items, blobs)])
+        stage.length = sum(reference.size for reference in references)
 
-            print(f"\t{image_id=} {image_format=:04x} {offset=} {length=}")
-            file_offset_lengths.append((image_id, offset, length))
-        else:
-            print(f"\t{image_id=} empty")
-            file_offset_lengths.append((
-                image_id,
-                stream.tell(),  # wrongly pretend.
-                0
-            ))
+    # remember where everything went so the next pack can be incremental against this output
+    entries = []
+    for index, ((image_id, image_format, path), data, reference) in enumerate(zip(items, blobs, references)):
+        if data is None:
+            continue
 
-    stream.seek(file_info_offset)
-    print("writing metadata...")
-    print(ref_end_offset)
-    for (image_id, image_offset, image_length) in file_offset_lengths:
-        print(f"\t{image_id=} {image_offset=} {image_length=}")
-        stream.write(int.to_bytes(image_id, 4, "little"))
-        stream.write(int.to_bytes(image_offset - ref_end_offset, 4, "little"))
-        stream.write(int.to_bytes(image_length, 4, "little"))  # account for header
+        entries.append(make_entry(
+            image_id=image_id,
+            path=path,
+            source_hash=source_hashes[index],
+            blob_hash=digest(data),
+            offset=reference.offset,
+            size=reference.size
+        ))
+    if write_manifest:
+        try:
+            save_manifest(manifest_path, entries)
+        except OSError as exception:
+            # the database is already written, a read-only source directory shouldn't fail the pack now
+            logger.warning("could not write %s, the next pack can't reuse this one: %s", manifest_path, exception)
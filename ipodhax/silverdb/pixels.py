@@ -0,0 +1,12 @@
+import numpy as np
+
+# per-channel lookup tables matching utils.pixel_from565, for decoding whole arrays at once.
+# they live here rather than in utils so only the image code pays for importing numpy
+PIXEL_FROM565_R = np.array([int(value * (255 / 0b11111)) for value in range(0b100000)], dtype=np.uint8)
+PIXEL_FROM565_G = np.array([int(value * (255 / 0b111111)) for value in range(0b1000000)], dtype=np.uint8)
+PIXEL_FROM565_B = PIXEL_FROM565_R
+
+# per-channel lookup tables matching utils.pixel_to565, indexed by 8-bit channel value
+PIXEL_TO565_R = np.array([int(0b11111 * (value / 255)) for value in range(0x100)], dtype=np.uint16)
+PIXEL_TO565_G = np.array([int(0b111111 * (value / 255)) for value in range(0x100)], dtype=np.uint16)
+PIXEL_TO565_B = PIXEL_TO565_R
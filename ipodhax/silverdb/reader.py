@@ -0,0 +1,131 @@
+from __future__ import annotations
+from typing import Iterator, Optional, Union
+from collections import OrderedDict
+import mmap
+
+from PIL import Image
+import numpy as np
+
+from .unpack import (
+    FileReference, ImageHeader, IMAGE_HEADER_LENGTH, SILVERDB_MAGIC, parse_image_header, decode_image, palette_fromBGRA
+)
+from ..schema import FILE_REFERENCE, SILVERDB_HEADER
+from ..utils import MappedBuffer
+
+HEADER_LENGTH = SILVERDB_HEADER.size
+REFERENCE_LENGTH = FILE_REFERENCE.size
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+class SilverDBFile(MappedBuffer):
+    """
+    the parts every SilverDB shares: the header and the reference table, parsed from a buffer or a memory map.
+    entries are only sliced out when asked for.
+    """
+    TABLE_TYPE: Optional[str] = None  # paMB for image, mTDL for language, None accepts both
+
+    def __init__(self, buffer: Buffer):
+        self._buffer = memoryview(buffer)
+
+        if self._buffer[0:4] != SILVERDB_MAGIC:
+            raise ValueError("invalid magic")
+        _, self.code_page, self.table_type, self.table_type_str, file_count, self.unk0, self.unk1 = (
+            SILVERDB_HEADER.unpack(self._buffer)
+        )
+
+        if self.TABLE_TYPE is not None and self.table_type_str != self.TABLE_TYPE:
+            raise ValueError(f"expected a {self.TABLE_TYPE} database: {self.table_type_str}")
+
+        self.ref_end_offset = HEADER_LENGTH + file_count * REFERENCE_LENGTH
+
+        self.references: dict[int, FileReference] = {}
+        for values in FILE_REFERENCE.iter_unpack(self._buffer[HEADER_LENGTH:self.ref_end_offset]):
+            reference = FileReference(*values)
+            self.references[reference.id] = reference
+
+    def close(self):
+        # any memoryview returned by raw() must be released before this
+        self._buffer.release()
+        super().close()
+
+    def __len__(self) -> int:
+        return len(self.references)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.references)
+
+    def __contains__(self, file_id: int) -> bool:
+        return file_id in self.references
+
+    def raw(self, file_id: int) -> memoryview:
+        """the whole entry as stored, any per-entry header included. empty entries give an empty view."""
+        reference = self.references[file_id]
+        offset = self.ref_end_offset + reference.offset
+        return self._buffer[offset:offset + reference.size]
+
+
+class SilverDB(SilverDBFile):
+    """
+    random access to the images of a SilverDB without extracting the whole thing.
+    only the header and the reference table are parsed up front, images are decoded on demand.
+    """
+    TABLE_TYPE = "paMB"
+
+    def __init__(self, buffer: Buffer, *, cache_size: int = 0):
+        super().__init__(buffer)
+        self._cache: OrderedDict[int, Optional[Image.Image]] = OrderedDict()
+        self.cache_size = cache_size
+
+    def close(self):
+        self._cache.clear()
+        super().close()
+
+    def header(self, image_id: int) -> Optional[ImageHeader]:
+        data = self.raw(image_id)
+        if len(data) < IMAGE_HEADER_LENGTH:
+            # apparently they give you some files with offset=0 size=0
+            return None
+
+        header = parse_image_header(data[:IMAGE_HEADER_LENGTH])
+        if header.id != image_id:
+            raise ValueError(f"id does not match for {image_id}: {header.id}")
+        if header.size + IMAGE_HEADER_LENGTH != len(data):
+            raise ValueError(f"size does not match for {image_id}: {header.size}")
+
+        return header
+
+    def palette(self, image_id: int) -> Optional[np.ndarray]:
+        """RGBA palette of a 0x0064 or 0x0065 image, None for anything else"""
+        header = self.header(image_id)
+        if header is None or header.image_format not in {0x0064, 0x0065}:
+            return None
+
+        palette, _ = palette_fromBGRA(self.raw(image_id)[IMAGE_HEADER_LENGTH:])
+        return palette
+
+    def image(self, image_id: int) -> Optional[Image.Image]:
+        """decodes one image, None for empty entries or formats we can't decode"""
+        if image_id in self._cache:
+            self._cache.move_to_end(image_id)
+            return self._cache[image_id]
+
+        header = self.header(image_id)
+        if header is None:
+            image = None
+        else:
+            # copy the payload out so the image does not pin the mapping
+            image = decode_image(
+                image_format=header.image_format,
+                row_length=header.row_length,
+                width=header.width,
+                height=header.height,
+                data=bytes(self.raw(image_id)[IMAGE_HEADER_LENGTH:])
+            )
+
+        if self.cache_size > 0:
+            self._cache[image_id] = image
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return image
@@ -1,12 +1,26 @@
 from __future__ import annotations
-from typing import BinaryIO
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass
 from pathlib import Path
+import logging
+import math
+import mmap
+import time
 import io
 
 from PIL import Image
+import numpy as np
 
-from ..utils import pixel_fromBGRA, pixels_from565
+from .manifest import MANIFEST_NAME, ManifestEntry, digest, make_entry, save_manifest
+from .pixels import PIXEL_FROM565_R, PIXEL_FROM565_G, PIXEL_FROM565_B
+from ..instrument import Instrument, instrument_or_null
+from ..schema import FILE_REFERENCE, IMAGE_HEADER, SILVERDB_HEADER
+from ..utils import COPY_BUFFER_SIZE
+
+SILVERDB_MAGIC = b"\x03\x00\x00\x00"
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -16,152 +30,541 @@ class FileReference:
     size: int
 
 
-def unpack_silverdb(stream: BinaryIO, directory: Path):
-    if stream.read(4) != b"\x03\x00\x00\x00":
+@dataclass
+class ImageHeader:
+    image_format: int
+    unk0: int  # always 1
+    row_length: int
+    flags: int
+    unk1: int  # always 0
+    unk2: int  # always 0
+    height: int
+    width: int
+    id: int  # this should match the FileReference ID
+    size: int  # this should match the FileReference size - 32 to account for header
+
+
+IMAGE_HEADER_LENGTH = IMAGE_HEADER.size  # 32
+STRIP_BYTES = 0x100000  # decoded bytes per strip, see decode_image
+MIN_STRIP_BYTES = 0x10000  # the smallest strips a memory_limit shrinks them to
+WORKER_MEMORY = 0x2800000  # about what an extraction worker sits at with numpy and Pillow loaded
+
+
+def parse_image_header(data: bytes) -> ImageHeader:
+    return ImageHeader(*IMAGE_HEADER.unpack(data))
+
+
+def palette_fromBGRA(data: bytes) -> tuple[np.ndarray, int]:
+    palette_length = int.from_bytes(data[0:4], "little")
+    palette_end = 4 + palette_length * 4
+    palette = np.frombuffer(data, dtype=np.uint8, count=palette_length * 4, offset=4)
+    return palette.reshape(palette_length, 4)[:, [2, 1, 0, 3]], palette_end
+
+
+def _rows(data: bytes, dtype, row_length: int, height: int, offset: int = 0) -> np.ndarray:
+    # row_length is in bytes, rows may be padded past the visible width
+    itemsize = np.dtype(dtype).itemsize
+    columns = row_length // itemsize
+    return np.frombuffer(data, dtype=dtype, count=columns * height, offset=offset).reshape(height, columns)
+
+
+def _strips(height: int, row_bytes: int, strip_bytes: int) -> Iterator[slice]:
+    rows = max(1, strip_bytes // max(1, row_bytes))
+    for top in range(0, height, rows):
+        yield slice(top, min(height, top + rows))
+
+
+def decode_image(
+    image_format: int,
+    row_length: int,
+    width: int,
+    height: int,
+    data: bytes,
+    *,
+    strip_bytes: int = STRIP_BYTES
+) -> Image.Image | None:
+    """
+    decodes into one buffer of just the visible pixels, allocated up front and filled a strip of rows at a time,
+    so on top of the output there is never more than about strip_bytes of temporaries
+    """
+    if image_format == 0x0008:
+        # 8-bit greyscale, might be inverted? already the right layout, the image uses data as is
+        pixels = _rows(data, np.uint8, row_length, height)
+        # rows are wider than the image when padded, the stride skips the padding instead of cropping
+        return Image.frombuffer("L", (min(width, pixels.shape[1]), height), pixels, "raw", "L", pixels.strides[0], 1)
+
+    if image_format == 0x1888:
+        # BGRA, big endian
+        source = _rows(data, np.uint8, row_length, height).reshape(height, row_length // 4, 4)
+        channels, mode = 4, "RGBA"
+
+        def decode(rows: slice, out: np.ndarray):
+            strip = source[rows, :out.shape[1]]
+            for channel, source_channel in enumerate((2, 1, 0, 3)):
+                out[:, :, channel] = strip[:, :, source_channel]
+
+    elif image_format == 0x0004:
+        # 4-bit greyscale, might be inverted? two pixels a byte, high nibble first
+        source = _rows(data, np.uint8, row_length, height)
+        channels, mode = 1, "L"
+
+        def decode(rows: slice, out: np.ndarray):
+            visible = out.shape[1]
+            out[:, 0::2] = source[rows, :(visible + 1) // 2] >> 4
+            out[:, 1::2] = source[rows, :visible // 2] & 0b1111
+            out *= 17
+
+    elif image_format == 0x0565:
+        # RGB565, not supported by Pillow
+        source = _rows(data, "<u2", row_length, height)
+        channels, mode = 4, "RGBA"
+
+        def decode(rows: slice, out: np.ndarray):
+            packed = source[rows, :out.shape[1]]
+            out[:, :, 0] = PIXEL_FROM565_R[packed >> 11]
+            out[:, :, 1] = PIXEL_FROM565_G[(packed >> 5) & 0b111111]
+            out[:, :, 2] = PIXEL_FROM565_B[packed & 0b11111]
+            out[:, :, 3] = 0xFF
+
+    elif image_format in {0x0064, 0x0065}:
+        # hack: palette does not support BGRA so we can't use .raw
+        palette, palette_end = palette_fromBGRA(data)
+        source = _rows(data, np.uint8 if image_format == 0x0064 else "<u2", row_length, height, offset=palette_end)
+        channels, mode = 4, "RGBA"
+
+        def decode(rows: slice, out: np.ndarray):
+            out[:] = palette[source[rows, :out.shape[1]]]
+
+    else:
+        return None
+
+    # rows are wider than the image when padded, only the visible part is decoded
+    visible = min(width, source.shape[1] * (2 if image_format == 0x0004 else 1))
+    pixels = np.empty((height, visible, channels) if channels > 1 else (height, visible), dtype=np.uint8)
+    for rows in _strips(height, visible * channels, strip_bytes):
+        decode(rows, pixels[rows])
+
+    return Image.frombuffer(mode, (visible, height), pixels, "raw", mode, 0, 1)
+
+
+def _save_empty(file: FileReference, directory: Path):
+    # apparently they give you some files with offset=0 size=0, there is no header to read
+    logger.debug("%d is empty", file.id)
+    (directory / f"{file.id}_empty.bin").touch()
+
+
+def _check_header(file: FileReference, header: ImageHeader, offset: int) -> bool:
+    logger.debug(
+        "file_id=%d offset=%d image_format=0x%04x flags=0x%04x row_length=%d dimensions=%dx%d size=%d unk0=%d unk1=%d unk2=%d",
+        header.id, offset, header.image_format, header.flags, header.row_length, header.width, header.height,
+        header.size, header.unk0, header.unk1, header.unk2
+    )
+
+    matches = True
+    if file.id != header.id:
+        matches = False
+        logger.warning("%d: id does not match, header says %d", file.id, header.id)
+    if file.size != header.size + IMAGE_HEADER_LENGTH:
+        matches = False
+        logger.warning("%d: size does not match, reference says %d, header says %d", file.id, file.size, header.size)
+
+    return matches
+
+
+def _extract_image(
+    file: FileReference,
+    read_at: Callable[[int, int], bytes],
+    ref_end_offset: int,
+    directory: Path,
+    *,
+    raw: bool = False,
+    previews: bool = False,
+    strip_bytes: int = STRIP_BYTES
+) -> Tuple[Optional[int], Optional[ManifestEntry]]:
+    # returns the image format if it was left unfiltered, and the manifest entry if something was saved
+    if file.size == 0:
+        _save_empty(file, directory)
+        return None, None
+
+    offset = ref_end_offset + file.offset
+    header = parse_image_header(read_at(offset, IMAGE_HEADER_LENGTH))
+    if not _check_header(file, header, offset):
+        return None, None
+
+    return _save_image(
+        file, header, read_at(offset, file.size), directory, raw=raw, previews=previews, strip_bytes=strip_bytes
+    )
+
+
+def _extract_entry(
+    file: FileReference,
+    data: memoryview,
+    offset: int,
+    directory: Path,
+    *,
+    raw: bool = False,
+    previews: bool = False,
+    strip_bytes: int = STRIP_BYTES
+) -> Tuple[Optional[int], Optional[ManifestEntry]]:
+    # like _extract_image for an entry that has already been read whole, offset is only for logging
+    if file.size == 0:
+        _save_empty(file, directory)
+        return None, None
+
+    header = parse_image_header(data)
+    if not _check_header(file, header, offset):
+        return None, None
+
+    return _save_image(file, header, data, directory, raw=raw, previews=previews, strip_bytes=strip_bytes)
+
+
+def _save_image(
+    file: FileReference,
+    header: ImageHeader,
+    data: bytes,
+    directory: Path,
+    *,
+    raw: bool = False,
+    previews: bool = False,
+    strip_bytes: int = STRIP_BYTES
+) -> Tuple[Optional[int], Optional[ManifestEntry]]:
+    # data is the whole entry, the image header included
+    unfiltered_type = None
+
+    if raw:
+        # the entry exactly as stored: the 32 byte image header followed by the payload
+        path = directory / f"{file.id}_{header.image_format:04x}.bin"
+        with open(path, "wb") as file_stream:
+            file_stream.write(data)
+
+        entry = make_entry(
+            image_id=file.id,
+            path=path,
+            source_hash=digest(data),
+            blob_hash=digest(data),
+            offset=file.offset,
+            size=file.size
+        )
+        if not previews:
+            return unfiltered_type, entry
+
+    image = decode_image(
+        image_format=header.image_format,
+        row_length=header.row_length,
+        width=header.width,
+        height=header.height,
+        data=data[IMAGE_HEADER_LENGTH:],
+        strip_bytes=strip_bytes
+    )
+    if image is None:
+        unfiltered_type = header.image_format
+        image = Image.new(mode="RGBA", size=(header.width, header.height))
+
+    # encode in memory first so the manifest can hash the PNG without reading it back
+    png_stream = io.BytesIO()
+    image.save(png_stream, "png")
+    png_data = png_stream.getbuffer()
+
+    path = directory / f"{file.id}_{header.image_format:04x}.png"
+    with open(path, "wb") as file_stream:
+        file_stream.write(png_data)
+
+    if raw:
+        # only a preview, the manifest tracks the raw record
+        return unfiltered_type, entry
+
+    entry = make_entry(
+        image_id=file.id,
+        path=path,
+        source_hash=digest(png_data),
+        blob_hash=digest(data),
+        offset=file.offset,
+        size=file.size
+    )
+    return unfiltered_type, entry
+
+
+_worker_mapping: Optional[mmap.mmap] = None
+
+
+def _init_worker(path: Path):
+    global _worker_mapping
+    with open(path, "rb") as stream:
+        _worker_mapping = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _mapping_read_at(offset: int, length: int) -> memoryview:
+    return memoryview(_worker_mapping)[offset:offset + length]
+
+
+def _extract_images(
+    files: List[FileReference], ref_end_offset: int, directory: Path, raw: bool, previews: bool, strip_bytes: int
+):
+    # runs in a worker process, errors are sent back instead of killing the whole pool
+    unfiltered_types = set()
+    entries = []
+    errors = []
+    timings = []
+
+    for file in files:
+        start = time.perf_counter()
+        try:
+            unfiltered_type, entry = _extract_image(
+                file, _mapping_read_at, ref_end_offset, directory, raw=raw, previews=previews, strip_bytes=strip_bytes
+            )
+        except Exception as exception:
+            errors.append((file.id, repr(exception)))
+        else:
+            if unfiltered_type is not None:
+                unfiltered_types.add(unfiltered_type)
+            if entry is not None:
+                entries.append(entry)
+        timings.append((file.id, time.perf_counter() - start, file.size))
+
+    return unfiltered_types, entries, errors, timings
+
+
+def _image_memory(size: int, strip_bytes: int) -> int:
+    # decoded pixels are at most 4 bytes for every stored byte, the PNG encoded from them about as much again
+    return size * 8 + strip_bytes
+
+
+def _fit_memory(
+    memory_limit: int, workers: int, files: List[FileReference], strip_bytes: Optional[int]
+) -> Tuple[int, int]:
+    """
+    how many of workers fit in memory_limit when each could be on the biggest image at once, at least one, and the
+    strip size for them. without a strip_bytes of its own, strips shrink towards MIN_STRIP_BYTES when even one
+    worker wouldn't fit with the default
+    """
+    biggest = max((file.size for file in files), default=0)
+    fixed = WORKER_MEMORY + _image_memory(biggest, 0)
+    workers = max(1, min(workers, memory_limit // (fixed + (strip_bytes or STRIP_BYTES))))
+
+    if strip_bytes is None:
+        strip_bytes = min(STRIP_BYTES, max(MIN_STRIP_BYTES, memory_limit // workers - fixed))
+
+    per_worker = fixed + strip_bytes
+    if per_worker * workers > memory_limit:
+        logger.warning("memory_limit of %d is below the %d one worker may need", memory_limit, per_worker)
+    return workers, strip_bytes
+
+
+def _seekable(stream: BinaryIO) -> bool:
+    try:
+        return stream.seekable()
+    except (AttributeError, ValueError):
+        return False
+
+
+def _read_exactly(stream: BinaryIO, length: int) -> bytes:
+    # a pipe can hand back less than asked for
+    chunks = []
+    remaining = length
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            raise ValueError(f"truncated database: got {length - remaining} of {length} bytes")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+
+def _skip(stream: BinaryIO, length: int):
+    # read and dropped rather than seeked past, so a pipe works too. it's only ever a padding byte or so
+    while length > 0:
+        length -= len(_read_exactly(stream, min(length, COPY_BUFFER_SIZE)))
+
+
+def _read_header(stream: BinaryIO) -> Tuple[int, int, str, int, int, int]:
+    """code_page, table_type, table_type_str, file_count, unk0, unk1 from the start of a SilverDB"""
+    header = _read_exactly(stream, SILVERDB_HEADER.size)
+    if header[0:4] != SILVERDB_MAGIC:
         raise ValueError("invalid magic")
-    code_page = int.from_bytes(stream.read(4), "little")
-    table_type = int.from_bytes(stream.read(4), "little")  # 1 for image, 2 (or 3?) for language
-    table_type_str = stream.read(4).decode("ascii")  # paMB for image, mTDL for language
-    file_count = int.from_bytes(stream.read(4), "little")
-    unk0 = int.from_bytes(stream.read(4), "little")
-    unk1 = int.from_bytes(stream.read(4), "little")
-
-    print(f"{code_page=} {table_type=} {table_type_str=}")
-    print(f"{file_count=} {unk0=} {unk1=}")
+    return SILVERDB_HEADER.unpack(header)[1:]
+
+
+def _read_references(stream: BinaryIO, file_count: int) -> List[FileReference]:
+    return [
+        FileReference(*values)
+        for values in FILE_REFERENCE.iter_unpack(_read_exactly(stream, file_count * FILE_REFERENCE.size))
+    ]
+
+
+def _iter_entries(stream: BinaryIO, files: List[FileReference], ref_end_offset: int) -> Iterator[Tuple[FileReference, memoryview]]:
+    """
+    every entry of files with its data, in one forward pass over stream, which has to be right after the reference table.
+    entries come in the order they are stored, not in table order. empty entries get an empty view, and an entry
+    inside the one before it (the same offset twice) is sliced out of that instead of read again.
+    """
+    position = ref_end_offset
+    previous_start = position
+    previous = memoryview(b"")
+
+    # the biggest entry at an offset first, so the others there fit inside it
+    for file in sorted(files, key=lambda file: (file.offset, -file.size)):
+        if file.size == 0:
+            yield file, memoryview(b"")
+            continue
+
+        start = ref_end_offset + file.offset
+        if start < position:
+            if previous_start <= start and start + file.size <= previous_start + len(previous):
+                yield file, previous[start - previous_start:start - previous_start + file.size]
+                continue
+            raise ValueError(f"{file.id} overlaps an earlier entry, it can't be read without going back")
+
+        _skip(stream, start - position)
+        previous_start = start
+        previous = memoryview(_read_exactly(stream, file.size))
+        position = start + file.size
+        yield file, previous
+
+
+def iter_silverdb(stream: BinaryIO) -> Iterator[Tuple[int, Optional[ImageHeader], memoryview]]:
+    """
+    (id, header, payload) for every image in a paMB database, read front to back in one pass so stream can be a pipe.
+    images come in the order they are stored rather than by id, empty ones with no header and an empty payload.
+    only about one image is held at a time.
+    """
+    code_page, table_type, table_type_str, file_count, unk0, unk1 = _read_header(stream)
+    if table_type_str != "paMB":
+        raise ValueError(f"expected a paMB database: {table_type_str}")
+
+    files = _read_references(stream, file_count)
+    ref_end_offset = SILVERDB_HEADER.size + file_count * FILE_REFERENCE.size
+
+    for file, data in _iter_entries(stream, files, ref_end_offset):
+        if len(data) == 0:
+            yield file.id, None, data
+        else:
+            yield file.id, parse_image_header(data), data[IMAGE_HEADER_LENGTH:]
+
+
+def unpack_silverdb(
+    stream: BinaryIO,
+    directory: Path,
+    *,
+    workers: Optional[int] = None,
+    raw: bool = False,
+    previews: bool = False,
+    memory_limit: Optional[int] = None,
+    strip_bytes: Optional[int] = None,
+    language: bool = False,
+    encoding: str = "utf-8",
+    instrument: Optional[Instrument] = None
+):
+    # raw writes each entry untouched as {id}_{format}.bin, previews adds PNGs next to them.
+    # memory_limit (in bytes) runs fewer workers than asked for when that many might not fit, and decodes in smaller
+    # strips when even one might not. strip_bytes sets the strip size directly, see decode_image.
+    # language unpacks mTDL databases as text in encoding, which is off until their layout is known to be right
+    instrument = instrument_or_null(instrument)
+
+    code_page, table_type, table_type_str, file_count, unk0, unk1 = _read_header(stream)
+
+    logger.info("code_page=%d table_type=%d table_type_str=%s file_count=%d", code_page, table_type, table_type_str, file_count)
+    logger.debug("unk0=%d unk1=%d", unk0, unk1)
 
     if table_type_str == "paMB":
-        files = []
-        for file_index in range(file_count):
-            files.append(FileReference(
-                id=int.from_bytes(stream.read(4), "little"),
-                offset=int.from_bytes(stream.read(4), "little"),
-                size=int.from_bytes(stream.read(4), "little")
-            ))
-        ref_end_offset = stream.tell()
-        print(f"{ref_end_offset=}")
-        print(files)
-
-        # apparently they give you some files with offset=0 size=0?
+        with instrument.timed("references") as stage:
+            files = _read_references(stream, file_count)
+            ref_end_offset = SILVERDB_HEADER.size + file_count * FILE_REFERENCE.size
+            stage.length = ref_end_offset
+        logger.debug("ref_end_offset=%d", ref_end_offset)
 
         unfiltered_types = set()
-
-        for file in files:
-            offset = ref_end_offset + file.offset
-            print(f"{offset=}")
-            stream.seek(offset)
-
-            image_format = int.from_bytes(stream.read(2), "little")
-            file_unk0 = int.from_bytes(stream.read(2), "little")  # always 1
-            row_length = int.from_bytes(stream.read(2), "little")
-            flags = int.from_bytes(stream.read(2), "little")
-            file_unk1 = int.from_bytes(stream.read(4), "little")  # always 0
-            file_unk2 = int.from_bytes(stream.read(4), "little")  # always 0
-            height = int.from_bytes(stream.read(4), "little")
-            width = int.from_bytes(stream.read(4), "little")
-            file_id = int.from_bytes(stream.read(4), "little")  # this should match the earlier ID
-            file_size = int.from_bytes(stream.read(4), "little")  # this should match the earlier size + 32 to account for header
-
-            file_accounted_for_size = file_size + 32
-            should_skip = False
-
-            print(f"{file_id=}")
-            print(f"\timage_format: 0x{image_format:04x} == 0b{image_format:016b}")
-
-            # if image_format == 0x0565 and width == 240 and height == 240:
-            #     print(f"OK! TAKE THIS! {stream.tell()}")
-
-            print(f"\tflags: 0x{flags:04x} == 0b{flags:016b}")
-            print(f"\trow_length: {row_length}")
-            print(f"\tdimensions: {width}x{height}")
-            print(f"\tsize: {file_size}")
-            print(f"\tfile: {file}")
-            print(f"\t{file_unk0=} {file_unk1=} {file_unk2=}")
-
-            if file.id != file_id:
-                should_skip = True
-                print(f"\t!!! id does not match! {file.id=}")
-            if file.size != file_accounted_for_size:
-                should_skip = True
-                print(f"\t!!! size does not match! {file.size=}")
-
-                if file.size == 0:
-                    (directory / f"{file.id}_empty.bin").touch()
-
-            if should_skip:
-                continue
-
-            # with open(OUT_PATH / f"{file.id}_{image_format:04x}.bin", "wb") as file_stream:
-            #     file_stream.write(image_data)
-
-            pixels = []
-            file_stream = io.BytesIO(stream.read(file_size))  # lazy
-
-            greyscale = False
-            data_width = width
-
-            if image_format == 0x1888:
-                # BGRA, big endian
-                for _ in range((row_length // 4) * height):
-                    pixels.append(pixel_fromBGRA(file_stream))
-
-            elif image_format == 0x0004:
-                # 4-bit greyscale, might be inverted?
-                greyscale = True
-                data_width = row_length * 2
-                for _ in range(row_length * height):
-                    data = file_stream.read(1)[0]
-                    pixels.append(17 * (data >> 4))
-                    pixels.append(17 * (data & 0b1111))
-
-            elif image_format == 0x0008:
-                # 8-bit greyscale, might be inverted?
-                greyscale = True
-                data_width = row_length
-                for _ in range(row_length * height):
-                    pixels.append(file_stream.read(1)[0])
-
-            elif image_format == 0x0565:
-                # RGB565, not supported by Pillow
-                data_width = row_length // 2
-                pixels = pixels_from565(file_stream, (row_length // 2 * height) * 2)
-
-            elif image_format == 0x0064:
-                # hack: palette does not support BGRA so we can't use .raw
-                palette_length = int.from_bytes(file_stream.read(4), "little")
-                palette = []
-                for _ in range(palette_length):
-                    palette.append(pixel_fromBGRA(file_stream))
-
-                for _ in range(row_length * height):
-                    index = file_stream.read(1)[0]
-                    pixels.append(palette[index])
-
-            elif image_format == 0x0065:
-                palette_length = int.from_bytes(file_stream.read(4), "little")
-                palette = []
-
-                for _ in range(palette_length):
-                    palette.append(pixel_fromBGRA(file_stream))
-
-                for _ in range((row_length // 2) * height):
-                    index = int.from_bytes(file_stream.read(2), "little")
-                    pixels.append(palette[index])
+        entries = []
+
+        if memory_limit is not None:
+            workers, strip_bytes = _fit_memory(memory_limit, workers or 1, files, strip_bytes)
+            logger.info("extracting with %d workers and %d byte strips to stay within memory_limit", workers, strip_bytes)
+        elif strip_bytes is None:
+            strip_bytes = STRIP_BYTES
+
+        with instrument.timed("extract") as stage:
+            if workers and workers > 1:
+                try:
+                    stream.fileno()
+                    path = Path(stream.name)
+                except (AttributeError, io.UnsupportedOperation):
+                    raise ValueError("parallel extraction needs a stream backed by a file")
+
+                # split the table into a few chunks per worker so one slow chunk doesn't hold everything up
+                chunk_size = max(1, math.ceil(len(files) / (workers * 4)))
+                chunks = [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+
+                errors = []
+                done = 0
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(path,)) as executor:
+                    futures = [executor.submit(_extract_images, chunk, ref_end_offset, directory, raw, previews, strip_bytes) for chunk in chunks]
+                    for future in as_completed(futures):
+                        chunk_unfiltered_types, chunk_entries, chunk_errors, chunk_timings = future.result()
+                        unfiltered_types.update(chunk_unfiltered_types)
+                        entries.extend(chunk_entries)
+                        errors.extend(chunk_errors)
+
+                        for file_id, seconds, length in chunk_timings:
+                            instrument.image("extract", file_id, seconds, length)
+                            stage.length += length
+                        done += len(chunk_timings)
+                        instrument.progress("extract", done, len(files))
+
+                for file_id, error in errors:
+                    logger.error("failed to extract %d: %s", file_id, error)
+                if len(errors) > 0:
+                    raise ValueError(f"failed to extract {len(errors)} images")
             else:
-                unfiltered_types.add(image_format)
-
-            image = Image.new(
-                mode="L" if greyscale else "RGBA",
-                size=(data_width, height)
-            )
-            image.putdata(pixels)
-
-            if data_width != width:
-                image = image.crop((0, 0, width, height))
-
-            image.save(directory / f"{file.id}_{image_format:04x}.png", "png")
+                if _seekable(stream):
+                    # table order, seeking to every entry, so a reference that disagrees with its header is just skipped
+                    ref_end_position = stream.tell()
+
+                    def stream_read_at(offset: int, length: int) -> bytes:
+                        stream.seek(offset)
+                        return _read_exactly(stream, length)
+
+                    results = (
+                        (file, *_extract_image(
+                            file, stream_read_at, ref_end_position, directory,
+                            raw=raw, previews=previews, strip_bytes=strip_bytes
+                        ))
+                        for file in files
+                    )
+                else:
+                    # a pipe, one forward pass in the order the entries are stored. it can't go back for an entry
+                    # overlapping the one before, _iter_entries raises then
+                    results = (
+                        (file, *_extract_entry(
+                            file, data, ref_end_offset + file.offset, directory,
+                            raw=raw, previews=previews, strip_bytes=strip_bytes
+                        ))
+                        for file, data in _iter_entries(stream, files, ref_end_offset)
+                    )
+
+                start = time.perf_counter()
+                for done, (file, unfiltered_type, entry) in enumerate(results, start=1):
+                    if unfiltered_type is not None:
+                        unfiltered_types.add(unfiltered_type)
+                    if entry is not None:
+                        entries.append(entry)
+
+                    now = time.perf_counter()
+                    instrument.image("extract", file.id, now - start, file.size)
+                    instrument.progress("extract", done, len(files))
+                    stage.length += file.size
+                    start = now
+
+        # lets pack_silverdb copy untouched images straight out of this database later
+        save_manifest(directory / MANIFEST_NAME, entries)
 
         if len(unfiltered_types) > 0:
-            print(f"left unfiltered: {unfiltered_types}")
+            logger.warning("left unfiltered: %s", ", ".join(f"0x{image_type:04x}" for image_type in sorted(unfiltered_types)))
     elif table_type_str == "mTDL":
         # apparently one file with ID 1400140320 always?
-        pass
+        if not language:
+            logger.warning("skipping an mTDL language database, its layout is unverified, pass language=True to unpack it")
+            return
+
+        from .language import LanguageDB, unpack_language  # language imports this module through reader
+
+        with LanguageDB.from_stream(stream, encoding=encoding) as database:
+            unpack_language(database, directory)
@@ -1,4 +1,81 @@
-from typing import BinaryIO, Tuple, List
+from typing import BinaryIO, Optional, Tuple, List
+from pathlib import Path
+from collections import OrderedDict
+import errno
+import mmap
+import stat
+import os
+import io
+
+COPY_BUFFER_SIZE = 0x100000
+_KERNEL_COPY_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTSOCK, errno.EBADF}
+
+
+def _file_object_descriptor(stream: BinaryIO) -> Optional[int]:
+    # only a plain file object stands for exactly the bytes of its descriptor. wrappers like gzip.GzipFile,
+    # bz2.BZ2File or lzma.LZMAFile hand out the descriptor underneath them too, copying to that skips the compressor
+    raw = stream.raw if isinstance(stream, (io.BufferedReader, io.BufferedWriter, io.BufferedRandom)) else stream
+    if not isinstance(raw, io.FileIO):
+        return None
+    return raw.fileno()
+
+
+def _regular_file_descriptor(stream: BinaryIO) -> Optional[int]:
+    descriptor = _file_object_descriptor(stream)
+    if descriptor is None:
+        return None
+
+    return descriptor if stat.S_ISREG(os.fstat(descriptor).st_mode) else None
+
+
+def _kernel_copy(source: BinaryIO, destination: BinaryIO, limit: Optional[int]) -> int:
+    # copies without the data ever entering python, returns how far it got before the kernel refused
+    source_descriptor = _regular_file_descriptor(source)
+    if source_descriptor is None:
+        return 0
+    destination_descriptor = _file_object_descriptor(destination)
+    if destination_descriptor is None:
+        return 0
+
+    destination_is_file = _regular_file_descriptor(destination) is not None
+
+    # the file objects buffer on top of the descriptors, so work with explicit offsets and sync up afterwards
+    destination.flush()
+    source_offset = source.tell()
+    destination_offset = destination.tell() if destination_is_file else None
+    remaining = (os.fstat(source_descriptor).st_size - source_offset) if limit is None else limit
+
+    copied = 0
+    try:
+        while remaining > 0:
+            amount = min(remaining, 0x40000000)
+            if destination_is_file and hasattr(os, "copy_file_range"):
+                written = os.copy_file_range(
+                    source_descriptor, destination_descriptor, amount,
+                    source_offset + copied, destination_offset + copied
+                )
+            elif hasattr(os, "sendfile"):
+                if destination_is_file:
+                    os.lseek(destination_descriptor, destination_offset + copied, os.SEEK_SET)
+                written = os.sendfile(destination_descriptor, source_descriptor, source_offset + copied, amount)
+            else:
+                break
+
+            if written == 0:
+                # end of the source
+                break
+            copied += written
+            remaining -= written
+    except OSError as exception:
+        if exception.errno not in _KERNEL_COPY_ERRORS:
+            raise
+        # not supported between these two, whatever is left goes through a buffer
+
+    source.seek(source_offset + copied)
+    if destination_is_file:
+        destination.seek(destination_offset + copied)
+
+    return copied
 
 
 def buffered_copy(
@@ -6,21 +83,38 @@ def buffered_copy(
     destination: BinaryIO,
     *,
     limit: int = None,
-    buffer_size: int = 0x1000
-):
-    offset = 0
+    buffer_size: int = COPY_BUFFER_SIZE
+) -> int:
+    """
+    copies up to limit bytes, or everything, from the current position of source to destination.
+    returns how many bytes were actually copied, which is less than limit if source ran out.
+    """
+    copied = _kernel_copy(source, destination, limit)
+    if limit is not None and copied >= limit:
+        return copied
 
-    while True:
-        read_amount = min(buffer_size, limit - offset) if limit else buffer_size
-        buffer = source.read(read_amount)
-        offset += read_amount
+    buffer = memoryview(bytearray(buffer_size))
+    readinto = getattr(source, "readinto", None)
 
-        destination.write(buffer)
+    while limit is None or copied < limit:
+        read_amount = buffer_size if limit is None else min(buffer_size, limit - copied)
 
-        if len(buffer) < buffer_size:
-            # either we've hit the limit or there is no more data
+        if readinto is not None:
+            read_length = readinto(buffer[:read_amount])
+        else:
+            data = source.read(read_amount)
+            read_length = len(data)
+            buffer[:read_length] = data
+
+        if not read_length:
+            # no more data
             break
 
+        destination.write(buffer[:read_length])
+        copied += read_length
+
+    return copied
+
 
 def pixel_from565(pixel: int) -> Tuple[int, int, int]:
     return (
@@ -77,3 +171,188 @@ def pixel_fromBGRA(stream: BinaryIO) -> Tuple[int, int, int, int]:
         color[0],
         color[3]
     )
+
+
+class ViewReader(io.RawIOBase):
+    """read-only, seekable file object over a buffer. only what is read gets copied."""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+
+    @property
+    def view(self) -> memoryview:
+        return self._view
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._view[self._position:self._position + len(buffer)]
+        length = len(data)
+        memoryview(buffer).cast("B")[:length] = data
+        self._position += length
+        return length
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = len(self._view) + offset
+        else:
+            raise ValueError(f"invalid whence {whence}")
+
+        if position < 0:
+            raise ValueError("negative seek position")
+        self._position = position
+        return position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+def map_stream(stream: BinaryIO) -> Tuple[object, Optional[mmap.mmap]]:
+    """memory maps stream when it is a real file, otherwise reads all of it. returns (buffer, the map or None)"""
+    try:
+        mapping = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, io.UnsupportedOperation):
+        stream.seek(0)
+        return stream.read(), None
+
+    return mapping, mapping
+
+
+class MappedBuffer:
+    """
+    open/from_stream/close and the context manager for things that hand out views of one buffer,
+    usually a memory map they own. subclasses release their own views in close() before calling up to this.
+    """
+    _mmap: Optional[mmap.mmap] = None
+
+    @classmethod
+    def _from_buffer(cls, buffer, **kwargs):
+        return cls(buffer, **kwargs)
+
+    @classmethod
+    def _from_mapping(cls, mapping: mmap.mmap, **kwargs):
+        instance = cls._from_buffer(mapping, **kwargs)
+        instance._mmap = mapping
+        return instance
+
+    @classmethod
+    def open(cls, path: Path, **kwargs):
+        with open(path, "rb") as stream:
+            mapping = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls._from_mapping(mapping, **kwargs)
+
+    @classmethod
+    def from_stream(cls, stream: BinaryIO, **kwargs):
+        buffer, mapping = map_stream(stream)
+        if mapping is None:
+            return cls._from_buffer(buffer, **kwargs)
+        return cls._from_mapping(mapping, **kwargs)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, *args):
+        try:
+            self.close()
+        except BufferError:
+            # the frames of an exception on its way out can still hold views, don't hide it behind this one
+            if exception_type is None:
+                raise
+
+
+class CachedReader(io.RawIOBase):
+    """
+    read-only, seekable file object over a stream that is slow to seek, like a deflated zip member.
+    reads go through fixed size blocks and the most recently used ones are kept, so memory stays bounded.
+    """
+
+    def __init__(self, stream: BinaryIO, length: int, *, block_size: int = COPY_BUFFER_SIZE, cache_blocks: int = 16):
+        self._stream = stream
+        self._length = length
+        self._position = 0
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self._cache: OrderedDict[int, bytes] = OrderedDict()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def _block(self, index: int) -> bytes:
+        block = self._cache.get(index)
+        if block is not None:
+            self._cache.move_to_end(index)
+            return block
+
+        offset = index * self.block_size
+        if self._stream.tell() != offset:
+            self._stream.seek(offset)  # a zip member decompresses from the start again to go backwards
+
+        block = self._stream.read(self.block_size)
+        self._cache[index] = block
+        if len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+        return block
+
+    def readinto(self, buffer) -> int:
+        output = memoryview(buffer).cast("B")
+        length = max(0, min(len(output), self._length - self._position))
+
+        filled = 0
+        while filled < length:
+            block = self._block(self._position // self.block_size)
+            start = self._position % self.block_size
+            chunk = block[start:start + length - filled]
+            if len(chunk) == 0:
+                break  # shorter than it said it was
+
+            output[filled:filled + len(chunk)] = chunk
+            filled += len(chunk)
+            self._position += len(chunk)
+
+        return filled
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._length + offset
+        else:
+            raise ValueError(f"invalid whence {whence}")
+
+        if position < 0:
+            raise ValueError("negative seek position")
+        self._position = position
+        return position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._cache.clear()
+            self._stream.close()
+        super().close()